@@ -0,0 +1,113 @@
+# admission.py — Control de admisión: token bucket por usuario + límite global de llamadas al LLM
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """No hay capacidad ahora mismo: el que llama debe responder con algo barato."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class UserBuckets:
+    """Token bucket por usuario: `rate` tokens/seg con ráfagas de hasta `burst`."""
+
+    def __init__(self, rate: float = 0.2, burst: float = 5, max_users: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()   # uid -> [tokens, último ts]
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, uid: str, cost: float = 1) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.get(uid)
+            if b is None:
+                b = self._buckets[uid] = [self.burst, now]
+                if len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(uid)
+                b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+                b[1] = now
+            if b[0] >= cost:
+                b[0] -= cost
+                return True
+            self.rejected += 1
+            return False
+
+
+class ConcurrencyGate:
+    """
+    Como mucho `limit` llamadas al LLM a la vez; hasta `max_waiting` esperan turno
+    (máx. `wait_timeout` s). Con la cola llena se rechaza al instante.
+    """
+
+    def __init__(self, limit: int = 8, max_waiting: int = 16, wait_timeout: float = 8.0):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._sem = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+
+    @contextmanager
+    def slot(self, timeout: float | None = None):
+        """timeout (opcional): espera máxima de este llamador, si es menor que wait_timeout."""
+        if not self._sem.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_waiting:
+                    self.rejected["queue_full"] += 1
+                    raise Overloaded("queue_full")
+                self.waiting += 1
+            try:
+                wait = self.wait_timeout if timeout is None else min(self.wait_timeout, timeout)
+                ok = self._sem.acquire(timeout=wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not ok:
+                with self._lock:
+                    self.rejected["timeout"] += 1
+                raise Overloaded("timeout")
+        with self._lock:
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.inflight -= 1
+            self._sem.release()
+
+
+BUCKETS = UserBuckets(
+    rate=float(os.getenv("ADMIT_USER_RATE", "0.5")),     # 1 llamada al LLM cada 2 s de media
+    burst=float(os.getenv("ADMIT_USER_BURST", "10")),
+)
+LLM_GATE = ConcurrencyGate(
+    limit=int(os.getenv("ADMIT_LLM_CONCURRENCY", "8")),
+    max_waiting=int(os.getenv("ADMIT_LLM_QUEUE", "16")),
+    wait_timeout=float(os.getenv("ADMIT_LLM_WAIT", "8")),
+)
+
+# Coste en tokens del bucket por tipo de trabajo
+COST = {"text": 1, "image": 3, "document": 3}
+
+
+def metrics() -> dict:
+    return {
+        "llm_inflight": LLM_GATE.inflight,
+        "llm_waiting": LLM_GATE.waiting,
+        "llm_rejected_queue_full": LLM_GATE.rejected["queue_full"],
+        "llm_rejected_timeout": LLM_GATE.rejected["timeout"],
+        "user_rejected": BUCKETS.rejected,
+    }
@@ -1,112 +1,522 @@
 # akira_brain.py — núcleo conversacional de Akira
 import os
-import re
+import threading
 import time
-from collections import deque
-from typing import Dict, Deque, List
+from collections import OrderedDict, deque
+from typing import Deque, List, Tuple
 
-try:
-    from openai import OpenAI
-    _OPENAI_OK = True
-except Exception:
-    _OPENAI_OK = False
+import deadline
+import compaction
+from admission import LLM_GATE, Overloaded
+from intents import MATCHER
+from jobs import JobQueue
+from llm_cache import CACHE as LLM_CACHE, ENABLED as CACHE_ENABLED, cache_key
+from llm_client import client_for, iter_deltas
+from outbound import SegmentStream
+from recall import RECALL_TOP_K, MemoryIndex
+from token_budget import REPLY_TOKENS_MIN, count_messages, count_tokens, fit_items, fit_recent, reply_budget
+from storage import MemoryBackend, SQLiteBackend, VersionConflict, open_shared
+from telemetry import count, record_usage, stage
 
 # ------------------------------
 # Memoria por usuario (en RAM)
 # ------------------------------
 # Nota: en Render (plan free) el filesystem es efímero y los procesos pueden reiniciarse;
-# esta memoria es temporal. Si quieres persistir, luego podemos usar Redis o una DB simple.
+# por defecto esta memoria es temporal. Con AKIRA_MEM_DB=ruta.db se persiste en SQLite
+# (los usuarios se cargan al primer mensaje y solo se escriben los cambios).
+# Está acotada: LRU por número de usuarios, expiración por inactividad y presupuesto de bytes.
+# Con varios procesos/instancias, AKIRA_MEM_SHARED=sqlite:///ruta.db | redis://... comparte el
+# estado: cada escritura es un compare-and-swap por versión de usuario y la copia en RAM
+# queda como caché de lectura que se revalida cada AKIRA_MEM_READ_TTL segundos.
+# Con AKIRA_SUMMARY=1 los turnos que salen de la ventana no se pierden: se pliegan en segundo
+# plano en un resumen acumulado por usuario (compaction.py) que viaja en el prompt.
+# Con muchos gustos guardados solo van al prompt los RECALL_TOP_K más relevantes para el
+# mensaje (índice BM25 por usuario, recall.py); con pocos van todos, como siempre.
+
+# Presupuesto de tokens del contexto por usuario dentro del prompt
+HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "1500"))
+LIKES_TOKENS   = int(os.getenv("PROMPT_LIKES_TOKENS", "150"))
+
+_TURN_OVERHEAD = 120   # bytes aprox. de un Turn + su slot en el deque
+_USER_OVERHEAD = 600   # bytes aprox. de un UserState vacío (listas, deque, clave)
+
+class Turn:
+    """Un turno del historial, compacto (sin dict por turno)."""
+    __slots__ = ("role", "content", "ts", "ntok")
+
+    def __init__(self, role: str, content: str, ts: float):
+        self.role = role
+        self.content = content
+        self.ts = ts
+        self.ntok = count_tokens(content) + 3   # + "Usuario: " / "Akira: "
+
+    def line(self) -> str:
+        who = "Usuario" if self.role == "user" else "Akira"
+        return f"{who}: {self.content}\n"
+
+class UserState:
+    __slots__ = ("created_at", "last_seen", "likes", "mood", "turns", "nbytes",
+                 "likes_str", "window", "history", "hist_tokens", "prompt", "version", "checked",
+                 "summary", "summary_upto", "evicted", "folding", "index")
+
+    def __init__(self, max_turns: int):
+        self.created_at = self.last_seen = time.time()
+        self.likes: List[str] = []                          # gustos ("me gusta ...")
+        self.mood = "neutral"                               # estado estimado
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)   # historial corto
+        self.nbytes = _USER_OVERHEAD
+        # Caché del contexto renderizado (se actualiza al mutar, solo de este usuario):
+        # window = (línea, tokens) de los turnos más recientes que caben en HISTORY_TOKENS
+        # (siempre un sufijo de turns), history = su texto
+        self.likes_str = "—"
+        self.window: Deque[Tuple[str, int]] = deque()
+        self.history = ""
+        self.hist_tokens = 0
+        self.prompt: List[dict] | None = None
+        # Versión en el backend compartido y cuándo se comprobó por última vez
+        self.version = 0
+        self.checked = self.created_at
+        # Resumen de lo que ya salió de la ventana (hasta el turno con ts summary_upto)
+        # + turnos expulsados aún sin plegar
+        self.summary = ""
+        self.summary_upto = 0.0
+        self.evicted: List[Turn] = []
+        self.folding = False
+        # Índice de gustos (recall.MemoryIndex); se arma la primera vez que hace falta
+        self.index: MemoryIndex | None = None
+
+    def recall_index(self) -> MemoryIndex:
+        if self.index is None:
+            self.index = MemoryIndex(("like", l) for l in self.likes)
+        return self.index
+
+    def likes_for(self, query: str | None) -> str:
+        """
+        Gustos para el prompt: los de likes_str, o los top-k relevantes si hay muchos. Si el
+        mensaje no toca k de ellos se completa con los más recientes: "—" diría que no hay.
+        """
+        if query is None or len(self.likes) <= RECALL_TOP_K:
+            return self.likes_str
+        picked = [h.text for h in self.recall_index().search(query, RECALL_TOP_K)]
+        for like in reversed(self.likes):
+            if len(picked) >= RECALL_TOP_K:
+                break
+            if like not in picked:
+                picked.append(like)
+        return ", ".join(fit_items(picked, LIKES_TOKENS))
+
+    def rebuild(self):
+        self.likes_str = ", ".join(fit_items(self.likes, LIKES_TOKENS)) if self.likes else "—"
+        recent = fit_recent(list(self.turns), HISTORY_TOKENS, measure=lambda t: t.ntok)
+        self.window = deque((t.line(), t.ntok) for t in recent)
+        self.history = "".join(line for line, _ in self.window)
+        self.hist_tokens = sum(n for _, n in self.window)
+        self.prompt = None
+
+    def push(self, t: Turn):
+        """Añade un turno a la ventana; salen por delante los que ya no caben (sin re-renderizar)."""
+        line = t.line()
+        self.window.append((line, t.ntok))
+        self.history += line
+        self.hist_tokens += t.ntok
+        while self.hist_tokens > HISTORY_TOKENS:
+            self.pop_oldest()
+
+    def pop_oldest(self):
+        line, ntok = self.window.popleft()
+        self.history = self.history[len(line):]
+        self.hist_tokens -= ntok
+
+def _render_context(likes: str, summary: str, history: str) -> str:
+    earlier = f"Resumen de la conversación anterior: {summary}\n" if summary else ""
+    return f"Gustos del usuario: {likes}\n{earlier}Historial reciente:\n{history}".strip()
+
 class Memory:
-    def __init__(self, max_turns: int = 12):
-        self.by_user: Dict[str, Dict] = {}
+    def __init__(self, max_turns: int = 12, max_users: int = 5000,
+                 idle_ttl: float = 7 * 24 * 3600, max_bytes: int = 64 * 1024 * 1024,
+                 backend: MemoryBackend | None = None, read_ttl: float = 1.0,
+                 summarizer=None, fold_batch: int = 4):
+        self.backend = backend or MemoryBackend()   # por defecto: solo RAM
+        self.shared = getattr(self.backend, "shared", False)
+        self.read_ttl = read_ttl   # (compartido) segundos que se confía en la copia local
+        # summarizer(resumen, [líneas]) -> resumen nuevo; None = los turnos viejos se descartan
+        self.summarizer = summarizer
+        self.fold_batch = max(1, fold_batch)
+        self._folds = JobQueue(workers=1, max_depth=10000, name="akira-fold") if summarizer else None
+        self.by_user: "OrderedDict[str, UserState]" = OrderedDict()
         self.max_turns = max_turns
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.evictions = {"lru": 0, "ttl": 0, "bytes": 0}
+        self.sync = {"reloads": 0, "conflicts": 0, "fold_races": 0}
+        self._last_sweep = time.time()
+        # _lock protege el estado en RAM (by_user, contadores, campos de UserState) y se
+        # suelta durante la E/S con el backend; _user_locks serializa, por usuario, la
+        # secuencia cargar → mutar → persistir. Orden: primero el del usuario, luego _lock.
+        self._lock = threading.RLock()
+        self._user_locks = [threading.Lock() for _ in range(64)]
 
-    def _ensure(self, uid: str):
-        if uid not in self.by_user:
-            self.by_user[uid] = {
-                "created_at": time.time(),
-                "likes": [],                 # gustos del usuario ("me gusta ...")
-                "mood": "neutral",           # estado estimado
-                "turns": deque(maxlen=self.max_turns),  # historial corto
-            }
-        return self.by_user[uid]
+    def _user_lock(self, uid: str) -> threading.Lock:
+        return self._user_locks[hash(uid) % len(self._user_locks)]
+
+    def _ensure(self, uid: str) -> UserState:
+        """Con el lock del usuario tomado (no _lock: carga y revalidación van sin él)."""
+        now = time.time()
+        check = False
+        with self._lock:
+            u = self.by_user.get(uid)
+            if u is not None:
+                self.by_user.move_to_end(uid)
+                if self.shared and now - u.checked > self.read_ttl:
+                    u.checked = now
+                    check = True
+        if u is None:
+            u = self._load(uid)
+            with self._lock:
+                self.by_user[uid] = u
+                self.nbytes += u.nbytes
+                self._enforce(keep=uid)
+        elif check and self.backend.version(uid) != u.version:
+            u = self._reload(uid)   # otro proceso lo cambió
+        with self._lock:
+            u.last_seen = now
+            sweep = now - self._last_sweep > 60
+        if sweep:
+            self.sweep(now)
+        return u
+
+    def _load(self, uid: str) -> UserState:
+        """Carga perezosa desde el backend la primera vez que se ve al usuario."""
+        u = UserState(self.max_turns)
+        data = self.backend.load(uid)
+        if data:
+            u.created_at = data["created_at"] or u.created_at
+            u.mood = data["mood"]
+            u.likes = list(data["likes"])
+            u.turns.extend(Turn(*t) for t in data["turns"])
+            u.nbytes += sum(len(x) + 60 for x in u.likes)
+            u.nbytes += sum(len(t.content) + _TURN_OVERHEAD for t in u.turns)
+            u.version = data.get("version", 0)
+            u.summary = data.get("summary") or ""
+            u.summary_upto = data.get("summary_upto") or 0.0
+            u.nbytes += len(u.summary)
+            if self._folds is not None:   # (compartido) expulsados que nadie plegó todavía
+                u.evicted = [Turn(*t) for t in data.get("unfolded", ())]
+                u.nbytes += sum(len(t.content) + _TURN_OVERHEAD for t in u.evicted)
+            u.rebuild()
+        return u
+
+    def _reload(self, uid: str) -> UserState:
+        u = self._load(uid)
+        with self._lock:
+            old = self.by_user.pop(uid, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.by_user[uid] = u
+            self.nbytes += u.nbytes
+            self.sync["reloads"] += 1
+        return u
+
+    def _commit(self, uid: str, u: UserState, op: str, *args):
+        """
+        Persiste un delta ya aplicado en RAM (con el lock del usuario, sin _lock). En modo
+        compartido es un compare-and-swap con la versión leída; si otro proceso escribió
+        antes, se recarga al usuario y se reintenta sobre la versión nueva (los deltas son
+        añadir/fijar: se pueden repetir).
+        El resumen no pasa por aquí en modo compartido: ver _store_summary.
+        """
+        if not self.shared:
+            self.backend.record(op, uid, *args)
+            return
+        delta = [(op, uid) + args]
+        for attempt in range(5):
+            try:
+                u.version = self.backend.apply(uid, delta, u.version)
+                break
+            except VersionConflict:
+                with self._lock:
+                    self.sync["conflicts"] += 1
+                u = self._reload(uid)
+        else:
+            raise VersionConflict(uid, u.version)
+        if attempt:
+            self._reload(uid)   # estado fusionado, ya con este delta
+
+    def _resize(self, uid: str, u: UserState, delta: int):
+        u.nbytes += delta
+        if self.by_user.get(uid) is not u:
+            return   # expulsado de la RAM mientras se hablaba con el backend
+        self.nbytes += delta
+        if delta > 0:
+            self._enforce(keep=uid)
+
+    def _drop(self, uid: str, reason: str):
+        u = self.by_user.pop(uid)
+        self.nbytes -= u.nbytes
+        self.evictions[reason] += 1
+
+    def _enforce(self, keep: str | None = None):
+        """Expulsa a los usuarios menos recientes mientras se pase de límites."""
+        while len(self.by_user) > self.max_users:
+            self._drop(next(iter(self.by_user)), "lru")
+        while self.nbytes > self.max_bytes and len(self.by_user) > 1:
+            oldest = next(iter(self.by_user))
+            if oldest == keep:
+                break
+            self._drop(oldest, "bytes")
+
+    def sweep(self, now: float | None = None):
+        """Elimina usuarios inactivos más de idle_ttl segundos."""
+        with self._lock:
+            now = now or time.time()
+            self._last_sweep = now
+            while self.by_user:
+                uid, u = next(iter(self.by_user.items()))
+                if now - u.last_seen <= self.idle_ttl:
+                    break   # orden LRU: el resto es más reciente
+                self._drop(uid, "ttl")
 
     def add_turn(self, uid: str, role: str, content: str):
-        u = self._ensure(uid)
-        u["turns"].append({"role": role, "content": content, "ts": time.time()})
+        with self._user_lock(uid):
+            u = self._ensure(uid)
+            with self._lock:
+                delta = len(content) + _TURN_OVERHEAD
+                if len(u.turns) == u.turns.maxlen:
+                    if len(u.window) == len(u.turns):   # el que sale sigue en la ventana
+                        u.pop_oldest()
+                    if self._folds is not None:
+                        u.evicted.append(u.turns[0])   # sus bytes cuentan hasta que se pliegue
+                    else:
+                        delta -= len(u.turns[0].content) + _TURN_OVERHEAD
+                ts = time.time()
+                t = Turn(role, content, ts)
+                u.turns.append(t)
+                u.push(t)
+                u.prompt = None
+                self._resize(uid, u, delta)
+            self._commit(uid, u, "turn", role, content, ts)
+            if self._folds is not None:
+                with self._lock:
+                    self._maybe_fold(uid, u)
+
+    def _maybe_fold(self, uid: str, u: UserState):
+        """Con _lock: encola el plegado de los turnos expulsados (uno a la vez por usuario)."""
+        if self._folds is None or u.folding:
+            return
+        if u.evicted and u.evicted[0].ts <= u.summary_upto:   # ya plegados (otro proceso)
+            self._set_evicted(uid, u, [t for t in u.evicted if t.ts > u.summary_upto])
+        if len(u.evicted) < self.fold_batch:
+            return
+        u.folding = True
+        # si el plegado estuvo fallando hay atraso: se pliega por tandas, sin descartar nada
+        batch = u.evicted[:4 * self.fold_batch]
+        if not self._folds.submit(uid, self._fold, uid, u, u.summary, u.summary_upto, batch):
+            u.folding = False
+
+    def _set_evicted(self, uid: str, u: UserState, keep: List[Turn]):
+        """Quita de los pendientes de plegar los que no estén en keep (y libera sus bytes)."""
+        freed = sum(len(t.content) + _TURN_OVERHEAD for t in u.evicted)
+        freed -= sum(len(t.content) + _TURN_OVERHEAD for t in keep)
+        u.evicted = keep
+        self._resize(uid, u, -freed)
+
+    def _fold(self, uid: str, u: UserState, summary: str, upto: float, batch: List[Turn]):
+        """Trabajo de fondo: la llamada al LLM va sin locks; el resultado se aplica con ellos."""
+        try:
+            new = self.summarizer(summary, [t.line() for t in batch])
+        except Exception as e:
+            print(">>> Resumen pendiente (se reintenta):", repr(e))
+            with self._lock:
+                u.folding = False
+            return
+        new_upto = batch[-1].ts
+        with self._user_lock(uid):
+            with self._lock:
+                u.folding = False
+                # por identidad: mientras el LLM resumía pudieron llegar (o recargarse) otros
+                folded = {id(t) for t in batch}
+                self._set_evicted(uid, u, [t for t in u.evicted if id(t) not in folded])
+                if not self.shared:
+                    self.backend.record("summary", uid, new, new_upto)
+                    if self.by_user.get(uid) is not u:
+                        return   # expulsado de la RAM mientras tanto: solo se persiste
+                    self._resize(uid, u, len(new) - len(u.summary))
+                    u.summary, u.summary_upto = new, new_upto
+                    u.prompt = None
+                    self._maybe_fold(uid, u)
+                    return
+            self._store_summary(uid, upto, new, new_upto)
+
+    def _store_summary(self, uid: str, upto: float, new: str, new_upto: float):
+        """
+        (compartido, con el lock del usuario) El resumen se reemplaza entero, así que no se
+        reintenta a ciegas como los deltas de _commit: solo se escribe si el backend sigue en
+        el resumen del que partió este plegado (mismo summary_upto). Si otro proceso plegó
+        antes se descarta: los turnos que su resumen no cubre siguen en el backend y se
+        pliegan sobre el resumen nuevo.
+        """
+        for _ in range(5):
+            data = self.backend.load(uid) or {}
+            if (data.get("summary_upto") or 0.0) != upto:
+                with self._lock:
+                    self.sync["fold_races"] += 1
+                break
+            try:
+                self.backend.apply(uid, [("summary", uid, new, new_upto)], data.get("version", 0))
+                break
+            except VersionConflict:
+                with self._lock:
+                    self.sync["conflicts"] += 1
+        if uid in self.by_user:
+            u = self._reload(uid)   # resumen y pendientes tal como quedaron
+            with self._lock:
+                self._maybe_fold(uid, u)
 
     def add_like(self, uid: str, thing: str):
-        u = self._ensure(uid)
         thing = thing.strip()
-        if thing and thing not in u["likes"]:
-            u["likes"].append(thing)
-
-    def get_context(self, uid: str) -> str:
-        u = self._ensure(uid)
-        likes = ", ".join(u["likes"]) if u["likes"] else "—"
-        history = ""
-        for t in u["turns"]:
-            who = "Usuario" if t["role"] == "user" else "Akira"
-            history += f"{who}: {t['content']}\n"
-        return f"Gustos del usuario: {likes}\nHistorial reciente:\n{history}".strip()
+        with self._user_lock(uid):
+            u = self._ensure(uid)
+            with self._lock:
+                if not thing or thing in u.likes:
+                    return
+                u.likes.append(thing)
+                if u.index is not None:
+                    u.index.add(thing, "like")
+                if len(u.likes) == 1:
+                    u.likes_str = thing
+                elif count_tokens(u.likes_str) + count_tokens(thing) < LIKES_TOKENS:
+                    u.likes_str = f"{u.likes_str}, {thing}"
+                u.prompt = None
+                self._resize(uid, u, len(thing) + 60)
+            self._commit(uid, u, "like", thing)
+
+    def is_fresh(self, uid: str) -> bool:
+        """True si el contexto del usuario es genérico (solo el turno actual, sin gustos)."""
+        with self._user_lock(uid):
+            u = self._ensure(uid)
+            with self._lock:
+                return len(u.turns) <= 1 and not u.likes and not u.summary
+
+    def get_likes(self, uid: str) -> List[str]:
+        with self._user_lock(uid):
+            if self.shared:
+                u = self._ensure(uid)
+            else:
+                with self._lock:
+                    u = self.by_user.get(uid)
+            with self._lock:
+                return list(u.likes) if u else []
+
+    def get_context(self, uid: str, query: str | None = None) -> str:
+        with self._user_lock(uid):
+            u = self._ensure(uid)
+            with self._lock:
+                return _render_context(u.likes_for(query), u.summary, u.history)
+
+    def get_prompt_messages(self, uid: str, query: str | None = None) -> List[dict]:
+        """
+        Mensajes de sistema (ánimo + contexto) ya renderizados; se cachean por usuario.
+        Con query y más de RECALL_TOP_K gustos, los gustos dependen del mensaje: sin caché.
+        """
+        with self._user_lock(uid):
+            u = self._ensure(uid)
+            with self._lock:
+                per_query = query is not None and len(u.likes) > RECALL_TOP_K
+                if u.prompt is None or per_query:
+                    context = _render_context(u.likes_for(query), u.summary, u.history)
+                    prompt = [
+                        {"role": "system", "content": f"Estado percibido del usuario: {u.mood}"},
+                        {"role": "system", "content": f"Contexto persistente:\n{context}"},
+                    ]
+                    if per_query:
+                        return prompt
+                    u.prompt = prompt
+                return u.prompt
 
     def set_mood(self, uid: str, mood: str):
-        u = self._ensure(uid)
-        u["mood"] = mood
+        with self._user_lock(uid):
+            u = self._ensure(uid)
+            with self._lock:
+                if u.mood == mood:
+                    return
+                u.mood = mood
+                u.prompt = None
+            self._commit(uid, u, "mood", mood)
 
     def get_mood(self, uid: str) -> str:
-        u = self._ensure(uid)
-        return u["mood"]
+        with self._user_lock(uid):
+            u = self._ensure(uid)
+            with self._lock:
+                return u.mood
 
-MEM = Memory(max_turns=12)
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self.by_user),
+                "approx_bytes": self.nbytes,
+                "evictions": dict(self.evictions),
+                **({"shared": dict(self.sync)} if self.shared else {}),
+                **({"folds": dict(self._folds.stats, depth=self._folds.depth())} if self._folds else {}),
+            }
 
-# --------------- Heurísticas rápidas (para UX ágil) ---------------
-GREET_WORDS = ("hola", "buenas", "hey", "ola", "holi")
-SAD_WORDS = ("triste", "depre", "deprimid", "mal", "ansioso", "ansiosa")
-HAPPY_WORDS = ("feliz", "logré", "logre", "me salió", "me salio", "contento", "contenta")
+def _make_backend() -> MemoryBackend | None:
+    if os.getenv("AKIRA_MEM_SHARED"):
+        # con resumen, el backend guarda también los expulsados pendientes de plegar, con
+        # holgura sobre la tanda máxima (4*FOLD_BATCH): con varios procesos compitiendo por
+        # plegar el atraso crece y lo que pase del tope se pierde sin resumir
+        keep = 16 * compaction.FOLD_BATCH if compaction.SUMMARY_ENABLED else 0
+        return open_shared(os.environ["AKIRA_MEM_SHARED"], max_turns=12, keep_unfolded=keep)
+    if os.getenv("AKIRA_MEM_DB"):
+        return SQLiteBackend(os.environ["AKIRA_MEM_DB"], max_turns=12)
+    return None
 
+MEM = Memory(
+    max_turns=12,
+    max_users=int(os.getenv("AKIRA_MEM_MAX_USERS", "5000")),
+    idle_ttl=float(os.getenv("AKIRA_MEM_IDLE_TTL", str(7 * 24 * 3600))),
+    max_bytes=int(os.getenv("AKIRA_MEM_MAX_BYTES", str(64 * 1024 * 1024))),
+    backend=_make_backend(),
+    read_ttl=float(os.getenv("AKIRA_MEM_READ_TTL", "1.0")),
+    summarizer=compaction.fold if compaction.SUMMARY_ENABLED else None,
+    fold_batch=compaction.FOLD_BATCH,
+)
+
+# --------------- Heurísticas rápidas (para UX ágil) ---------------
+# Las palabras clave viven en intents.py (compartidas con la GUI y mi_ia.py)
 def _quick_heuristics(uid: str, msg: str) -> str | None:
     """Respuestas instantáneas para cosas simples; devuelve None si debe ir a LLM."""
-    m = msg.lower().strip()
+    found = MATCHER.scan(msg)
 
     # guardar gustos: "me gusta ___"
-    if "me gusta" in m:
-        like = m.split("me gusta", 1)[-1].strip(" :,.¡!¿?\"'")
-        if like:
-            MEM.add_like(uid, like)
-            return f"¡Wau! También me gusta **{like}** 🐾😄 ¿Quieres que lo recuerde para recomendarte cosas?"
+    if "like_add" in found and found["like_add"].payload:
+        like = found["like_add"].payload
+        MEM.add_like(uid, like)
+        return f"¡Wau! También me gusta **{like}** 🐾😄 ¿Quieres que lo recuerde para recomendarte cosas?"
 
     # listar gustos
-    if "qué me gusta" in m or "que me gusta" in m:
-        likes = MEM.by_user.get(uid, {}).get("likes", [])
+    if "like_list" in found:
+        likes = MEM.get_likes(uid)
         if likes:
             return f"🐾 Me contaste que te gusta: {', '.join(likes)}."
         return "Aún no me has contado tus gustos 😅. Dime: *me gusta ...*"
 
     # saludo rápido
-    if any(w in m for w in GREET_WORDS):
+    if "greet" in found:
         return "¡Hey! 🐾 Soy Akira. ¿En qué te ayudo hoy — tarea, resumen, imagen o investigación?"
 
     # ánimo / estado
-    if any(w in m for w in SAD_WORDS):
+    if "sad" in found:
         MEM.set_mood(uid, "sad")
         return "Estoy contigo 💙 Respira, aquí estoy a tu lado. ¿Quieres que te explique algo o te saque un resumen rapidito?"
 
-    if any(w in m for w in HAPPY_WORDS):
+    if "happy" in found:
         MEM.set_mood(uid, "happy")
         return "¡Guau! ¡Qué emoción! 🐶💙 ¿Te ayudo a guardar ese logro o a planear lo que sigue?"
 
     return None  # que siga al LLM
 
-# --------------- Cliente OpenAI (perezoso) ---------------
-def _get_client():
-    if not _OPENAI_OK:
-        raise RuntimeError("El paquete openai no está disponible en el entorno.")
-    key = os.getenv("OPENAI_API_KEY")
-    if not key:
-        raise RuntimeError("Falta la variable de entorno OPENAI_API_KEY.")
-    return OpenAI(api_key=key)
-
 # --------------- Prompt de sistema ---------------
 SYSTEM_PROMPT = (
     "Eres **Akira**, una mascota IA leal, amigable y curiosa. Hablas en español, con tono cercano y empático, "
@@ -115,50 +525,108 @@ SYSTEM_PROMPT = (
     "si está feliz, celebra. Mantén las respuestas concisas pero útiles."
 )
 
+BUSY_REPLY = (
+    "Ahora mismo tengo muchísimos mensajes 🐾😅 Dame un minutito y vuelve a escribirme, "
+    "¡te respondo con calma!"
+)
+
 # --------------- Respuesta principal ---------------
-def akira_reply(user_id: str, text: str) -> str:
+def akira_reply(user_id: str, text: str, on_segment=None, admit=None) -> str:
     """
     Devuelve el texto de respuesta de Akira.
     - user_id: un identificador estable del usuario (en WhatsApp usamos 'From')
     - text: mensaje del usuario
+    - on_segment: si se pasa, la respuesta se pide en streaming y cada mensaje de
+      WhatsApp completo se entrega con on_segment(parte) en cuanto está listo
+      (también las respuestas rápidas/cacheadas: el que llama no envía nada más).
+    - admit: si se pasa, admit() decide justo antes de llamar al LLM si el usuario aún
+      tiene cupo; si no, responde BUSY_REPLY (heurísticas y caché no gastan cupo).
     """
+    seg = SegmentStream(on_segment) if on_segment else None
+
+    def done(reply: str) -> str:
+        MEM.add_turn(user_id, "assistant", reply)
+        if seg is not None:
+            if not streamed:
+                seg.feed(reply)
+            seg.close()
+        return reply
+
+    streamed = False
+
     # Guardar turno del usuario
     MEM.add_turn(user_id, "user", text)
 
     # Heurísticas rápidas (para feeling de inmediatez)
     quick = _quick_heuristics(user_id, text)
     if quick:
-        MEM.add_turn(user_id, "assistant", quick)
-        return quick
+        count("heuristic_hit")   # una llamada al LLM ahorrada
+        return done(quick)
 
-    # Preparar contexto corto
-    context = MEM.get_context(user_id)
-    mood = MEM.get_mood(user_id)
-    mood_line = f"Estado percibido del usuario: {mood}"
-
-    # Llamada al modelo
+    # Llamada al modelo (ánimo + contexto corto vienen ya renderizados de la memoria)
     try:
-        client = _get_client()
         messages: List[dict] = [
             {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "system", "content": mood_line},
-            {"role": "system", "content": f"Contexto persistente:\n{context}"},
+            *MEM.get_prompt_messages(user_id, query=text),
             {"role": "user", "content": text},
         ]
-        r = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.3,
-            max_tokens=600,
-        )
-        reply = (r.choices[0].message.content or "").strip()
+        # Solo se cachea si el prompt no lleva nada propio del usuario (primer mensaje,
+        # sin gustos): con historial la clave sería única y solo llenaría la caché.
+        # La respuesta se lleva lo que sobre del presupuesto por llamada
+        max_tokens = reply_budget(count_messages(messages))
+        key = None
+        if CACHE_ENABLED and MEM.is_fresh(user_id):
+            key = cache_key("gpt-4o-mini", messages, temperature=0.3, max_tokens=max_tokens)
+            reply = LLM_CACHE.get(key)
+            if reply is not None:
+                count("llm_cache_hit")
+                return done(reply)
+        if admit is not None and not admit():
+            count("shed_busy_reply")
+            return done(BUSY_REPLY)
+        # límite global de llamadas en vuelo (sin esperar más de lo que queda de deadline)
+        with LLM_GATE.slot(timeout=deadline.remaining()), stage("chat_llm"):
+            full = max_tokens
+            max_tokens, timeout = deadline.llm_params(max_tokens, floor=REPLY_TOKENS_MIN)
+            finish = []
+            count("llm_call")
+            r = client_for(timeout).chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.3,
+                max_tokens=max_tokens,
+                stream=seg is not None,
+                **({"stream_options": {"include_usage": True}} if seg is not None else {}),
+            )
+            if seg is None:
+                record_usage(getattr(r, "usage", None))
+                finish.append(r.choices[0].finish_reason)
+                reply = (r.choices[0].message.content or "").strip()
+            else:
+                parts = []
+                for delta in iter_deltas(r, on_usage=record_usage, on_finish=finish.append):
+                    streamed = True
+                    parts.append(delta)
+                    seg.feed(delta)
+                reply = "".join(parts).strip()
+        # si el deadline acortó la respuesta (o se cortó por tokens) no se cachea
+        if key and reply and max_tokens >= full and "length" not in finish:
+            LLM_CACHE.put(key, reply)
+    except Overloaded:
+        count("shed_busy_reply")
+        reply = BUSY_REPLY
     except Exception as e:
-        reply = (
+        count("llm_error")
+        error = (
             "Ups, no pude pensar ahora mismo 🤕. "
             "Revisa que la clave OPENAI_API_KEY esté configurada en el servidor. "
             f"Detalle: {e}"
         )
+        if streamed:   # el stream se cortó a medias: se avisa al final de lo ya enviado
+            seg.feed(f"\n\n{error}")
+            reply = "".join(parts).strip()
+        else:
+            reply = error
 
     # Guardar turno del asistente y devolver
-    MEM.add_turn(user_id, "assistant", reply)
-    return reply
+    return done(reply)
@@ -1,6 +1,6 @@
 # akira_gui.py — Akira con OpenAI + Memoria + Animaciones
 
-import os, random, json
+import os, queue, random, json, threading
 from pathlib import Path
 
 import tkinter as tk
@@ -8,105 +8,182 @@ from tkinter import scrolledtext
 from PIL import Image, ImageTk
 
 from dotenv import load_dotenv
-from openai import OpenAI
+
+import compaction
+from intents import MATCHER
+from llm_client import get_client
+from recall import RECALL_TOP_K, MemoryIndex
+from storage import SQLiteBackend
+from token_budget import count_messages, count_tokens, fit_items, fit_recent, reply_budget
 
 # ================== Config OpenAI ==================
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # ================== Memoria ==================
-MEM_FILE = Path("akira_memory.json")
+MEM_DB = Path("akira_memory.db")
+MEM_FILE = Path("akira_memory.json")   # formato antiguo; se importa una sola vez
+GUI_UID = "local"
 HISTORY_LIMIT = 8  # pares user/assistant recientes para el contexto
+HISTORY_TOKENS = 1500  # ...y como mucho estos tokens de historial
+LIKES_TOKENS = 150
+FACTS_TOKENS = 400
 
 # ================== “Cerebro” de Akira ==================
 class AkiraBrain:
-    def __init__(self):
+    def __init__(self, backend=None):
+        self.backend = backend or SQLiteBackend(str(MEM_DB))
+        self.summary = ""  # resumen acumulado de lo que ya salió del historial reciente
         self.memory = self._load_memory()
+        # índice BM25 de gustos/hechos: al prompt solo va lo relevante para el mensaje
+        self.index = MemoryIndex([("like", l) for l in self.memory["likes"]] +
+                                 [("fact", f) for f in self.memory["facts"]])
         self.history = []  # lista de tuplas: [("user", msg), ("assistant", msg), ...]
+        self._lock = threading.Lock()   # historial/resumen: los toca también el hilo de plegado
+        self._folding = False
 
     # -------- Persistencia --------
     def _load_memory(self):
+        data = self.backend.load(GUI_UID)
+        if data is not None:
+            self.summary = data.get("summary") or ""
+            return {"user_name": data["name"], "likes": data["likes"], "facts": data["facts"]}
+        memory = {"user_name": None, "likes": [], "facts": []}
         if MEM_FILE.exists():
             try:
-                return json.loads(MEM_FILE.read_text(encoding="utf-8"))
+                memory.update(json.loads(MEM_FILE.read_text(encoding="utf-8")))
             except Exception:
                 pass
-        return {"user_name": None, "likes": [], "facts": []}
-
-    def _save_memory(self):
-        try:
-            MEM_FILE.write_text(
-                json.dumps(self.memory, ensure_ascii=False, indent=2),
-                encoding="utf-8"
-            )
-        except Exception:
-            pass
+        # alta del usuario local (+ migración del JSON antiguo si existía)
+        self.backend.record("name", GUI_UID, memory["user_name"])
+        for l in memory["likes"]:
+            self.backend.record("like", GUI_UID, l)
+        for f in memory["facts"]:
+            self.backend.record("fact", GUI_UID, f)
+        return memory
 
     # -------- Comandos locales (no gastan API) --------
-    def _handle_commands(self, msg_lower):
+    def _handle_commands(self, found):
+        """found: resultado de MATCHER.scan() sobre el mensaje (una sola pasada)."""
         # me llamo ...
-        if msg_lower.startswith("me llamo"):
-            nombre = msg_lower.replace("me llamo", "", 1).strip()
+        if "name" in found:
+            nombre = found["name"].payload
             if nombre:
                 self.memory["user_name"] = nombre
-                self._save_memory()
+                self.backend.record("name", GUI_UID, nombre)
                 return (f"¡Mucho gusto, {nombre}! 🐶💙 Lo guardo.", "happy")
 
         # me gusta ...
-        if "me gusta" in msg_lower:
-            gusto = msg_lower.split("me gusta", 1)[-1].strip()
+        if "like_add" in found:
+            gusto = found["like_add"].payload
             if gusto:
-                self.memory["likes"].append(gusto)
-                self._save_memory()
+                if gusto not in self.memory["likes"]:
+                    self.memory["likes"].append(gusto)
+                    self.index.add(gusto, "like")
+                    self.backend.record("like", GUI_UID, gusto)
                 return (f"¡Anotado! Te gusta {gusto}. 😄", "happy")
 
         # qué me gusta
-        if "qué me gusta" in msg_lower or "que me gusta" in msg_lower:
+        if "like_list" in found:
             likes = self.memory["likes"]
             if likes:
                 return (f"Hasta ahora me dijiste que te gusta: {', '.join(likes)} 🐾", "happy")
             return ("Aún no me dijiste tus gustos 😅", "neutral")
 
         # recuerda que ...
-        if msg_lower.startswith("recuerda que"):
-            dato = msg_lower.replace("recuerda que", "", 1).strip(": ").strip()
+        if "remember" in found:
+            dato = found["remember"].payload
             if dato:
-                self.memory["facts"].append(dato)
-                self._save_memory()
+                if dato not in self.memory["facts"]:
+                    self.memory["facts"].append(dato)
+                    self.index.add(dato, "fact")
+                    self.backend.record("fact", GUI_UID, dato)
                 return ("¡Listo! Lo guardo en mi memoria 🐾", "happy")
             return ("¿Qué quieres que recuerde exactamente?", "neutral")
 
         # olvida ...
-        if msg_lower.startswith("olvida"):
-            dato = msg_lower.replace("olvida", "", 1).strip(": ").strip()
+        if "forget" in found:
+            dato = found["forget"].payload
             if dato:
-                self.memory["facts"] = [f for f in self.memory["facts"] if dato not in f]
-                self.memory["likes"] = [l for l in self.memory["likes"] if dato not in l]
-                self._save_memory()
+                # el índice da las entradas con todas las palabras de dato (sin recorrer listas)
+                for kind, texto in self.index.matching(dato):
+                    self.memory["likes" if kind == "like" else "facts"].remove(texto)
+                    self.index.remove(texto, kind)
+                    self.backend.record("unlike" if kind == "like" else "unfact", GUI_UID, texto)
                 return ("Hecho. Lo he olvidado 🫡", "neutral")
             return ("Dime qué debería olvidar.", "neutral")
 
         return None  # no es comando
 
-    # -------- LLM --------
-    def responder(self, msg: str):
-        msg_lower = msg.lower()
+    # -------- Historial + resumen acumulado --------
+    def _guardar(self, msg: str, texto: str):
+        with self._lock:
+            self.history.append(("user", msg))
+            self.history.append(("assistant", texto))
+        self._maybe_fold()
+
+    def _maybe_fold(self):
+        """Lo que sale de la ventana (HISTORY_LIMIT pares) se pliega en el resumen, en otro hilo."""
+        window = HISTORY_LIMIT * 2
+        with self._lock:
+            if (not compaction.SUMMARY_ENABLED or self._folding
+                    or len(self.history) < window + compaction.FOLD_BATCH):
+                return
+            batch = self.history[:len(self.history) - window]
+            self._folding = True
+        threading.Thread(target=self._fold, args=(batch,), name="akira-fold", daemon=True).start()
+
+    def _fold(self, batch):
+        lines = [f"{'Usuario' if role == 'user' else 'Akira'}: {content}\n" for role, content in batch]
+        try:
+            nuevo = compaction.fold(self.summary, lines)
+        except Exception as e:
+            print(">>> Resumen pendiente (se reintenta):", repr(e))
+            nuevo = None
+        with self._lock:
+            self._folding = False
+            if nuevo is None:
+                return
+            self.summary = nuevo
+            del self.history[:len(batch)]
+        self.backend.record("summary", GUI_UID, nuevo)
+
+    def _recordar(self, msg: str):
+        """(gustos, hechos) para el prompt: todos si son pocos, si no los top-k relevantes para msg."""
+        if len(self.index) <= RECALL_TOP_K:
+            return self.memory["likes"], self.memory["facts"]
+        hits = self.index.search(msg, RECALL_TOP_K)
+        return ([h.text for h in hits if h.kind == "like"],
+                [h.text for h in hits if h.kind == "fact"])
 
-        # 1) comandos locales primero
-        cmd = self._handle_commands(msg_lower)
+    # -------- LLM --------
+    def responder(self, msg: str, on_token=None, cancelado=None):
+        """
+        Devuelve (texto, estado). Si se pasa on_token, la respuesta llega en streaming
+        (on_token(fragmento) por cada trozo); si cancelado (threading.Event) se activa,
+        se corta el stream y no se guarda en el historial.
+        """
+        found = MATCHER.scan(msg)
+
+        # 1) comandos locales primero (con el lock: una petición cancelada puede seguir
+        #    en vuelo en otro hilo y tocar memoria/índice a la vez)
+        with self._lock:
+            cmd = self._handle_commands(found)
         if cmd:
-            self.history.append(("user", msg))
-            self.history.append(("assistant", cmd[0]))
+            self._guardar(msg, cmd[0])
             return cmd
 
         # 2) preparar system + contexto con memoria
         mem_summary = []
-        if self.memory.get("user_name"):
-            mem_summary.append(f"Nombre del usuario: {self.memory['user_name']}")
-        if self.memory.get("likes"):
-            mem_summary.append("Gustos del usuario: " + ", ".join(self.memory["likes"]))
-        if self.memory.get("facts"):
-            mem_summary.append("Hechos guardados: " + "; ".join(self.memory["facts"]))
+        with self._lock:
+            if self.memory.get("user_name"):
+                mem_summary.append(f"Nombre del usuario: {self.memory['user_name']}")
+            likes, facts = self._recordar(msg)
+            if likes:
+                mem_summary.append("Gustos del usuario: " + ", ".join(fit_items(likes, LIKES_TOKENS)))
+            if facts:
+                mem_summary.append("Hechos guardados: " + "; ".join(fit_items(facts, FACTS_TOKENS)))
+            if self.summary:
+                mem_summary.append(f"Resumen de lo que hablamos antes: {self.summary}")
 
         system_prompt = (
             "Eres Akira, una mascota IA leal, alegre y curiosa 🐾. "
@@ -116,68 +193,125 @@ class AkiraBrain:
         if mem_summary:
             system_prompt += "\n\nMemoria del usuario:\n" + "\n".join(mem_summary)
 
-        # 3) últimos turnos
-        recent = self.history[-(HISTORY_LIMIT*2):]
+        # 3) últimos turnos (por número y por presupuesto de tokens)
+        with self._lock:
+            ventana = self.history[-(HISTORY_LIMIT*2):]
+        recent = fit_recent(ventana, HISTORY_TOKENS,
+                            measure=lambda t: count_tokens(t[1]) + 4)
         chat_msgs = []
         for role, content in recent:
             chat_msgs.append(
                 {"role": "user" if role == "user" else "assistant", "content": content}
             )
 
+        messages = ([{"role": "system", "content": system_prompt}]
+                    + chat_msgs
+                    + [{"role": "user", "content": msg}])
+        trozos = []
         try:
-            resp = client.chat.completions.create(
+            resp = get_client().chat.completions.create(
                 model="gpt-4o-mini",
-                messages=[{"role": "system", "content": system_prompt}]
-                         + chat_msgs
-                         + [{"role": "user", "content": msg}],
+                messages=messages,
                 temperature=0.6,
+                max_tokens=reply_budget(count_messages(messages)),
+                stream=on_token is not None,
             )
-            texto = resp.choices[0].message.content
-
-            # guardar historial
-            self.history.append(("user", msg))
-            self.history.append(("assistant", texto))
+            if on_token is None:
+                texto = resp.choices[0].message.content
+            else:
+                for chunk in resp:
+                    if cancelado is not None and cancelado.is_set():
+                        resp.close()
+                        return ("", "neutral")
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        trozos.append(delta)
+                        on_token(delta)
+                texto = "".join(trozos)
+
+            # guardar historial (y plegar lo viejo en el resumen)
+            self._guardar(msg, texto)
 
             # elegir estado visual simple según el input del user
-            if any(p in msg_lower for p in ["feliz","lo logré","logre","me salió","me salio","contento","contenta"]):
-                return (texto, "happy")
-            if any(p in msg_lower for p in ["triste","mal","depre","deprimid"]):
-                return (texto, "sad")
-            if any(p in msg_lower for p in ["adiós","adios","chao","bye","nos vemos"]):
-                return (texto, "bye")
+            for estado in ("happy", "sad", "bye"):
+                if estado in found:
+                    return (texto, estado)
             return (texto, "neutral")
 
         except Exception as e:
-            return (f"Ups… tuve un problema con mi conexión 🤕 ({e})", "sad")
+            error = f"Ups… tuve un problema con mi conexión 🤕 ({e})"
+            if trozos and on_token is not None:
+                # el stream se cortó a medias: el aviso va detrás de lo ya mostrado
+                on_token(f"\n{error}")
+            return (error, "sad")
 
 # ================== Imágenes (expresiones) ==================
 FRAMES_FILES = {
     "neutral": {"base":"akira_neutral.png","blink":"akira_neutral_blink.png","tail":[]},
+    "thinking":{"base":"akira_neutral_blink.png","blink":"akira_neutral.png","tail":[]},
     "happy":   {"base":"akira_happy.png","blink":"akira_happy_blink.png","tail":["akira_happy_tail1.png","akira_happy_tail2.png"]},
     "sad":     {"base":"akira_sad.png","blink":"akira_sad.png","tail":[]},
     "bye":     {"base":"akira_bye.png","blink":"akira_bye.png","tail":[]},
 }
 
+SPRITE_CACHE_DIR = Path(".akira_cache")   # frames ya escalados (PNG pequeños)
+
+def _escalar(ruta, ancho):
+    """Imagen escalada a `ancho`, desde la caché en disco si el original no cambió."""
+    st = os.stat(ruta)
+    cache = SPRITE_CACHE_DIR / f"{Path(ruta).stem}_{ancho}_{st.st_mtime_ns}.png"
+    if cache.exists():
+        try:
+            return Image.open(cache).convert("RGBA")
+        except Exception:
+            pass
+    img = Image.open(ruta)
+    esc = ancho / float(img.width)
+    img = img.convert("RGBA").resize((ancho, int(img.height*esc)), Image.LANCZOS)
+    try:
+        SPRITE_CACHE_DIR.mkdir(exist_ok=True)
+        for viejo in SPRITE_CACHE_DIR.glob(f"{Path(ruta).stem}_{ancho}_*.png"):
+            viejo.unlink()   # versiones de un original anterior
+        img.save(cache, compress_level=1)
+    except Exception:
+        pass
+    return img
+
+_FOTOS = {}   # (ruta, ancho) -> PhotoImage: sad/bye reutilizan su base como blink
+
 def cargar_png(ruta, ancho=300):
+    """PhotoImage escalada; cada ruta se decodifica una sola vez por proceso."""
     if not ruta or not os.path.exists(ruta):
         return None
-    img = Image.open(ruta).convert("RGBA")
-    w, h = img.size
-    esc = ancho / float(w)
-    img = img.resize((int(w*esc), int(h*esc)), Image.LANCZOS)
-    return ImageTk.PhotoImage(img)
+    clave = (ruta, ancho)
+    if clave not in _FOTOS:
+        _FOTOS[clave] = ImageTk.PhotoImage(_escalar(ruta, ancho))
+    return _FOTOS[clave]
 
-def cargar_frames(mapa):
-    frames = {}
-    for estado, parts in mapa.items():
-        frames[estado] = {
+class Frames(dict):
+    """Frames por estado; cada estado se carga la primera vez que se usa."""
+
+    def __init__(self, mapa):
+        super().__init__()
+        self.mapa = mapa
+
+    def __missing__(self, estado):
+        parts = self.mapa[estado]
+        frame = {
             "base":  cargar_png(parts.get("base")),
             "blink": cargar_png(parts.get("blink")),
             "tail":  [f for f in (cargar_png(p) for p in parts.get("tail", [])) if f]
         }
-        if frames[estado]["blink"] is None:
-            frames[estado]["blink"] = frames[estado]["base"]
-    return frames
+        if frame["blink"] is None:
+            frame["blink"] = frame["base"]
+        self[estado] = frame
+        return frame
+
+    def get(self, estado, default=None):
+        return self[estado] if estado in self.mapa else default
+
+def cargar_frames(mapa):
+    return Frames(mapa)
 
 # ================== Interfaz (Tkinter) ==================
 class AkiraApp:
@@ -195,6 +329,13 @@ class AkiraApp:
         self.job_blink = None
         self.job_wag = None
 
+        # Respuestas en un hilo aparte; los eventos vuelven al loop de Tk por esta cola
+        self.eventos = queue.Queue()
+        self.peticion_id = 0
+        self.cancelado = None
+        self.streaming_id = None
+        self.job_eventos = None
+
         # GRID
         self.root.rowconfigure(1, weight=1)
         self.root.columnconfigure(0, weight=1)
@@ -262,6 +403,12 @@ class AkiraApp:
         self._set_frame(tails[self.cola_index % len(tails)])
         self.cola_index = (self.cola_index + 1) % len(tails)
 
+    def _append_stream(self, text):
+        self.chat.config(state="normal")
+        self.chat.insert(tk.END, text)
+        self.chat.config(state="disabled")
+        self.chat.yview(tk.END)
+
     def _append(self, speaker, text):
         self.chat.config(state="normal")
         self.chat.insert(tk.END, f"{speaker}: {text}\n")
@@ -307,11 +454,55 @@ class AkiraApp:
         msg = self.entry.get().strip()
         if not msg: return
         self.entry.delete(0, tk.END)
-        self._append("Tú", msg)
 
-        texto, estado = self.brain.responder(msg)
-        self._append("Akira", texto)
-        self._aplicar_estado(estado)
+        # un mensaje nuevo cancela la respuesta que siga en vuelo
+        if self.cancelado is not None:
+            self.cancelado.set()
+            if self.streaming_id is not None:
+                self._append_stream("\n")
+            self.streaming_id = None
+        self.peticion_id += 1
+        self.cancelado = threading.Event()
+
+        self._append("Tú", msg)
+        self._aplicar_estado("thinking")
+        threading.Thread(
+            target=self._trabajar, args=(msg, self.peticion_id, self.cancelado), daemon=True
+        ).start()
+        if self.job_eventos is None:
+            self.job_eventos = self.root.after(30, self._procesar_eventos)
+
+    def _trabajar(self, msg, pid, cancelado):
+        """Corre en un hilo: nunca toca widgets, solo encola eventos."""
+        on_token = lambda t: self.eventos.put(("token", pid, t))
+        texto, estado = self.brain.responder(msg, on_token=on_token, cancelado=cancelado)
+        self.eventos.put(("fin", pid, (texto, estado)))
+
+    def _procesar_eventos(self):
+        self.job_eventos = None
+        try:
+            while True:
+                tipo, pid, dato = self.eventos.get_nowait()
+                if pid != self.peticion_id:
+                    continue   # respuesta de una petición cancelada
+                if tipo == "token":
+                    if self.streaming_id != pid:
+                        self.streaming_id = pid
+                        self._append_stream("Akira: ")
+                    self._append_stream(dato)
+                else:
+                    texto, estado = dato
+                    if self.streaming_id == pid:
+                        self._append_stream("\n")
+                    else:
+                        self._append("Akira", texto)   # comando local o error: llega entero
+                    self.streaming_id = None
+                    self.cancelado = None
+                    self._aplicar_estado(estado)
+        except queue.Empty:
+            pass
+        if self.cancelado is not None:   # sigue habiendo una petición en vuelo
+            self.job_eventos = self.root.after(30, self._procesar_eventos)
 
 # ================== Run ==================
 if __name__ == "__main__":
@@ -1,32 +1,70 @@
 # analyzer.py — Procesa documentos e imágenes (Twilio media) con OpenAI + OCR
-import os, io, base64, requests
+import os, io, base64, re, tempfile, threading, time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
 from io import BytesIO
-from dotenv import load_dotenv
-from openai import OpenAI
 
-# Extracción de PDF/DOCX
-from pdfminer.high_level import extract_text as pdf_extract_text
-from docx import Document
+# pdfminer, python-docx, pytesseract y Pillow se importan dentro de las funciones que los
+# usan: el primer PDF/DOCX/imagen paga su carga, no el arranque de la app (/healthz).
 
-# OCR (fotos de cuaderno / manuscritos / impresos)
-import pytesseract
-from PIL import Image
-
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import deadline
+from admission import LLM_GATE, Overloaded
+from llm_cache import CACHE as LLM_CACHE, ENABLED as CACHE_ENABLED, cache_key
+from llm_client import client_for, iter_deltas
+from outbound import SegmentStream
+from telemetry import count, current as current_trace, observe, propagate, record_usage, stage
+from token_budget import count_tokens, split_text, truncate_to_tokens
 
 MAX_REPLY_CHARS = int(os.getenv("MAX_REPLY_CHARS", "1400"))
 
+# Documentos largos (map-reduce): tamaño de trozo, presupuesto total y paralelismo
+DOC_CHUNK_CHARS   = int(os.getenv("DOC_CHUNK_CHARS", "12000"))
+DOC_TOKEN_BUDGET  = int(os.getenv("DOC_TOKEN_BUDGET", "60000"))   # tokens de entrada por documento
+DOC_CONCURRENCY   = int(os.getenv("DOC_CONCURRENCY", "4"))        # trozos en vuelo por documento
+MAP_POOL_WORKERS  = int(os.getenv("MAP_POOL_WORKERS", "8"))       # hilos totales del proceso
+
+# Topes de salida del LLM (tokens): respuesta final y resúmenes parciales del map
+ANSWER_TOKENS     = int(os.getenv("ANSWER_TOKENS", "900"))
+MAP_ANSWER_TOKENS = int(os.getenv("MAP_ANSWER_TOKENS", "350"))
+
+# Con deadline (deadline.py): duración estimada de una ronda de mapas (MAP_ANSWER_TOKENS
+# de salida, en paralelo), de la pasada final (ANSWER_TOKENS) y tiempo mínimo para
+# intentar el fallback de OCR (OCR + otra llamada)
+DOC_MAP_SECONDS      = float(os.getenv("DEADLINE_DOC_MAP", "3"))
+DOC_REDUCE_SECONDS   = float(os.getenv("DEADLINE_DOC_REDUCE", "5"))
+OCR_FALLBACK_SECONDS = float(os.getenv("DEADLINE_OCR_MIN", "5"))
+
+# PDFs grandes: rangos de páginas en un pool de procesos (se crea al primer uso)
+PDF_PROCESSES          = int(os.getenv("PDF_PROCESSES", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+PDF_PAGES_PER_TASK     = int(os.getenv("PDF_PAGES_PER_TASK", "4"))
+_PDF_POOL = None
+
+# Los pools de procesos no heredan por fork los hilos/locks de Flask y del JobQueue
+POOL_START_METHOD = os.getenv(
+    "AKIRA_POOL_START",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Imágenes: OCR especulativo en paralelo a la visión, sobre imagen preprocesada
+IMAGE_SPECULATIVE_OCR = os.getenv("IMAGE_SPECULATIVE_OCR", "0") == "1"
+OCR_PROCESSES         = int(os.getenv("OCR_PROCESSES", "2"))
+OCR_MAX_EDGE          = int(os.getenv("OCR_MAX_EDGE", "1800"))
+_OCR_POOL = None
+
+# Imágenes para visión: lado máximo, formato/calidad de recompresión y nivel de detalle
+VISION_MAX_EDGE = int(os.getenv("VISION_MAX_EDGE", "1536"))
+VISION_FORMAT   = os.getenv("VISION_FORMAT", "JPEG").upper()    # JPEG | WEBP
+VISION_QUALITY  = int(os.getenv("VISION_QUALITY", "82"))
+VISION_DETAIL   = os.getenv("VISION_DETAIL", "auto").lower()    # auto | low | high
+VISION_LOW_EDGE = 768   # en modo auto, imágenes más pequeñas van con detail=low
+
 # ============== Utilidades generales ==============
 def chunk_text(s: str, max_len: int = 4000):
-    s = s.strip()
-    if len(s) <= max_len:
-        return [s]
-    parts, i = [], 0
-    while i < len(s):
-        parts.append(s[i:i+max_len])
-        i += max_len
-    return parts
+    # corta en fin de frase/palabra (nunca a mitad de palabra ni de un emoji)
+    return split_text(s, max_len)
 
 def split_for_whatsapp(text: str):
     parts = chunk_text(text, MAX_REPLY_CHARS)
@@ -35,48 +73,249 @@ def split_for_whatsapp(text: str):
     total = len(parts)
     return [f"({i+1}/{total})\n{p}" for i, p in enumerate(parts)]
 
-def llm_answer(system_prompt: str, user_content):
+def llm_answer(system_prompt: str, user_content, use_cache: bool = True, on_segment=None,
+               max_tokens: int = ANSWER_TOKENS):
+    """
+    on_segment: si se pasa, la respuesta se pide en streaming y se entrega por partes
+    de WhatsApp (outbound.SegmentStream) según se completan; igual se devuelve entera.
+    """
     messages = [{"role": "system", "content": system_prompt}]
     if isinstance(user_content, list):
         messages.append({"role": "user", "content": user_content})
     else:
         messages.append({"role": "user", "content": user_content})
-    r = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        temperature=0.2,
-    )
-    return r.choices[0].message.content.strip()
+    # Mismo prompt + mismo texto (p. ej. el mismo PDF de clase) → respuesta cacheada
+    key = None
+    if use_cache and CACHE_ENABLED:
+        key = cache_key("gpt-4o-mini", messages, temperature=0.2, max_tokens=max_tokens)
+        hit = LLM_CACHE.get(key)
+        if hit is not None:
+            count("llm_cache_hit")
+            if on_segment:
+                seg = SegmentStream(on_segment)
+                seg.feed(hit)
+                seg.close()
+            return hit
+    # Límite global de llamadas en vuelo: si está saturado lanza Overloaded
+    with LLM_GATE.slot(timeout=deadline.remaining()):
+        # con poco tiempo: respuesta más corta y timeout HTTP = lo que queda
+        full = max_tokens
+        max_tokens, timeout = deadline.llm_params(max_tokens)
+        finish = []
+        count("llm_call")
+        stream = on_segment is not None
+        r = client_for(timeout).chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            temperature=0.2,
+            max_tokens=max_tokens,
+            stream=stream,
+            **({"stream_options": {"include_usage": True}} if stream else {}),
+        )
+        if not stream:
+            record_usage(getattr(r, "usage", None))
+            finish.append(r.choices[0].finish_reason)
+            out = r.choices[0].message.content.strip()
+        else:
+            seg, parts = SegmentStream(on_segment), []
+            for delta in iter_deltas(r, on_usage=record_usage, on_finish=finish.append):
+                parts.append(delta)
+                seg.feed(delta)
+            seg.close()
+            out = "".join(parts).strip()
+    # una respuesta recortada por falta de tiempo no se cachea: la clave es la del tope completo
+    if key and out and max_tokens >= full and "length" not in finish:
+        LLM_CACHE.put(key, out)
+    return out
+
+def prewarm():
+    """Carga por adelantado lo que el primer PDF/DOCX/imagen importaría (y despierta a Tesseract)."""
+    import docx  # noqa: F401
+    import pdfminer.converter, pdfminer.pdfinterp, pdfminer.pdfpage  # noqa: F401,E401
+    from PIL import Image, ImageOps  # noqa: F401
+    import pytesseract
+    pytesseract.get_tesseract_version()   # ejecuta el binario: queda en la caché de disco
 
 # ============== Documentos ==============
-def extract_text_from_pdf_bytes(b: bytes) -> str:
+def iter_pdf_pages(b: bytes, page_numbers=None):
+    """Genera (nº de página, texto, segundos) página a página, sin parsear el resto."""
     with io.BytesIO(b) as fh:
-        return pdf_extract_text(fh) or ""
+        yield from _iter_pdf_file(fh, page_numbers)
+
+def _iter_pdf_file(fh, page_numbers=None):
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    rsrc = PDFResourceManager()
+    out = io.StringIO()
+    device = TextConverter(rsrc, out, laparams=LAParams())
+    interpreter = PDFPageInterpreter(rsrc, device)
+    numbers = sorted(page_numbers) if page_numbers else None
+    try:
+        for i, page in enumerate(PDFPage.get_pages(fh, pagenos=page_numbers)):
+            t0 = time.perf_counter()
+            interpreter.process_page(page)
+            text = out.getvalue()
+            out.seek(0)
+            out.truncate(0)
+            yield (numbers[i] if numbers else i), text, time.perf_counter() - t0
+    finally:
+        device.close()
+
+def _extract_page_range(path: str, start: int, end: int):
+    """Trabajo del pool de procesos: extrae las páginas [start, end) del PDF en `path`."""
+    with open(path, "rb") as fh:
+        return list(_iter_pdf_file(fh, page_numbers=set(range(start, end))))
+
+def _pdf_page_count(b: bytes) -> int:
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+    with io.BytesIO(b) as fh:
+        parser = PDFParser(fh)
+        return resolve1(PDFDocument(parser).catalog["Pages"]).get("Count", 0)
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context(POOL_START_METHOD))
+
+def _get_pdf_pool():
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        _PDF_POOL = _process_pool(PDF_PROCESSES)
+    return _PDF_POOL
+
+def _drop_pool(pool):
+    """
+    Un worker murió (OOM, señal): el pool queda roto para siempre, así que se descarta y el
+    siguiente uso crea otro. Solo si sigue siendo el actual (otro hilo pudo reemplazarlo ya).
+    """
+    global _PDF_POOL, _OCR_POOL
+    if _PDF_POOL is pool:
+        _PDF_POOL = None
+    if _OCR_POOL is pool:
+        _OCR_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+    count("process_pool_broken")
+
+def _iter_pdf_pages_parallel(b: bytes, n_pages: int):
+    """
+    Rangos de páginas en paralelo (pdfminer es Python puro y CPU-bound), entregados en orden.
+    Los workers leen el PDF de un fichero temporal: cada tarea envía (ruta, rango), no el PDF
+    entero. Si el pool se rompe, las páginas que falten se extraen aquí, en serie.
+    """
+    pool = _get_pdf_pool()
+    ranges = [(s, min(s + PDF_PAGES_PER_TASK, n_pages)) for s in range(0, n_pages, PDF_PAGES_PER_TASK)]
+    pending = deque()
+    next_page = 0
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(b)
+    try:
+        try:
+            for start, end in ranges:
+                # como mucho PDF_PROCESSES rangos en vuelo: si cortamos pronto, no se desperdicia CPU
+                if len(pending) >= PDF_PROCESSES:
+                    for item in pending.popleft().result():
+                        next_page = item[0] + 1
+                        yield item
+                pending.append(pool.submit(_extract_page_range, tmp.name, start, end))
+            while pending:
+                for item in pending.popleft().result():
+                    next_page = item[0] + 1
+                    yield item
+        except BrokenProcessPool:
+            pending.clear()
+            _drop_pool(pool)
+            if next_page < n_pages:
+                yield from iter_pdf_pages(b, page_numbers=set(range(next_page, n_pages)))
+    finally:
+        for f in pending:
+            f.cancel()
+        os.unlink(tmp.name)
+
+def extract_text_from_pdf_bytes(b: bytes, max_tokens: int | None = None, timings: list | None = None,
+                                info: dict | None = None) -> str:
+    """
+    Extrae el texto página a página y se detiene al llegar a max_tokens (por defecto el
+    presupuesto de documentos). Las páginas se separan con \f. Si se pasa `timings`,
+    se le añaden tuplas (página, segundos); si se pasa `info`, se rellena con
+    pages (total del PDF) y pages_used (páginas que entran completas en el texto).
+    """
+    max_tokens = max_tokens or DOC_TOKEN_BUDGET
+    try:
+        n_pages = _pdf_page_count(b)
+    except Exception:
+        n_pages = 0
+    if PDF_PROCESSES > 1 and n_pages >= PDF_PARALLEL_MIN_PAGES:
+        pages = _iter_pdf_pages_parallel(b, n_pages)
+    else:
+        pages = iter_pdf_pages(b)
+
+    parts, total = [], 0
+    for pageno, text, secs in pages:
+        if timings is not None:
+            timings.append((pageno, secs))
+        parts.append(text)
+        total += count_tokens(text)
+        if total >= max_tokens:
+            break
+    pages.close()
+    if info is not None:
+        info["pages"] = max(n_pages, len(parts))
+        info["pages_used"] = len(parts) - (total > max_tokens)   # la última, cortada, no cuenta
+    return truncate_to_tokens("\f".join(parts), max_tokens)
+
+def _report_page_timings(timings: list):
+    """Tiempos por página → histograma (etapa pdf_page), resumen en la traza y una línea de log."""
+    if not timings:
+        return
+    for _, secs in timings:
+        observe("pdf_page", secs)
+    slow_page, slow_secs = max(timings, key=lambda t: t[1])
+    total = sum(secs for _, secs in timings)
+    t = current_trace()
+    if t is not None:
+        t.set(pdf_pages=len(timings), pdf_page_ms_max=round(slow_secs * 1000, 1),
+              pdf_slowest_page=slow_page + 1)
+    print(f">>> PDF: {len(timings)} páginas en {total:.2f}s de CPU "
+          f"(más lenta: p{slow_page + 1}, {slow_secs * 1000:.0f} ms)")
 
 def extract_text_from_docx_bytes(b: bytes) -> str:
+    from docx import Document
     with io.BytesIO(b) as fh:
         doc = Document(fh)
     return "\n".join(p.text for p in doc.paragraphs).strip()
 
-def handle_document_bytes(content_type: str, data: bytes, mode: str = "resumen"):
+def handle_document_bytes(content_type: str, data: bytes, mode: str = "resumen", on_segment=None):
     """
     Procesa bytes de documento (PDF/DOCX/TXT). Úsalo cuando Twilio te da media protegida.
     mode: 'resumen' | 'explicar'
+    on_segment: si se pasa, la respuesta final se envía en streaming por ahí y se
+    devuelve solo lo que falte por enviar (normalmente []).
     """
     ct = (content_type or "").lower()
     text = ""
+    token_budget = doc_token_budget()
+    info = {}
 
     try:
         if "pdf" in ct:
-            text = extract_text_from_pdf_bytes(data)
+            timings = []
+            with stage("extract_pdf"):
+                text = extract_text_from_pdf_bytes(data, max_tokens=token_budget, timings=timings,
+                                                   info=info)
+            _report_page_timings(timings)
         elif "officedocument.wordprocessingml.document" in ct or "wordprocessingml" in ct:
-            text = extract_text_from_docx_bytes(data)
+            with stage("extract_docx"):
+                text = extract_text_from_docx_bytes(data)
         elif "text" in ct:
             text = data.decode("utf-8", errors="ignore")
         else:
             # intento como texto simple
             text = data.decode("utf-8", errors="ignore")
     except Exception:
+        count("extract_error")
         text = ""
 
     if not text.strip():
@@ -84,20 +323,82 @@ def handle_document_bytes(content_type: str, data: bytes, mode: str = "resumen")
             "No pude extraer texto del documento. Si es un PDF escaneado, envíalo como foto o usa un PDF con texto real."
         )
 
-    if mode == "explicar":
-        out = explain_text(text, "explica paso a paso")
-    else:
-        out = summarize_text(text, "resumen para estudiar")
-    return split_for_whatsapp(out)
+    note = _partial_note(text, token_budget, info)
+    if on_segment:
+        if note:
+            on_segment(note)
+        process_document_text(text, mode, on_segment=on_segment, token_budget=token_budget)
+        return []
+    reply = process_document_text(text, mode, token_budget=token_budget)
+    return split_for_whatsapp(f"{note}\n\n{reply}" if note else reply)
+
+def _partial_note(text: str, token_budget: int, info: dict) -> str:
+    """Aviso para el usuario si el resumen no cubre el documento entero ("" si lo cubre)."""
+    if "pages" in info:
+        if info["pages_used"] >= info["pages"]:
+            return ""
+        count("doc_partial")
+        return (f"⚠️ Resumen parcial ({info['pages_used']} de {info['pages']} páginas): "
+                "el documento no cabía completo.")
+    tokens = count_tokens(text)
+    if tokens > token_budget:
+        count("doc_partial")
+        return f"⚠️ Resumen parcial (~{100 * token_budget // tokens}% del texto): el documento no cabía completo."
+    return ""
+
+def doc_token_budget() -> int:
+    """
+    Tokens de documento que caben en el tiempo que queda: map-reduce necesita al menos
+    una ronda de mapas (en paralelo, salida corta) y la pasada final; si no da, un solo trozo.
+    """
+    left = deadline.remaining()
+    if left is None:
+        return DOC_TOKEN_BUDGET
+    map_rounds = int((left - DOC_REDUCE_SECONDS) // DOC_MAP_SECONDS)
+    chunk_tokens = DOC_CHUNK_CHARS // 4
+    if map_rounds < 1:
+        deadline.plan("document", "single_chunk", left_s=round(left, 2))
+        return chunk_tokens
+    budget = int(0.9 * chunk_tokens * max(1, DOC_CONCURRENCY) * map_rounds)
+    if budget < DOC_TOKEN_BUDGET:
+        deadline.plan("document", "truncate", tokens=budget, left_s=round(left, 2))
+        return budget
+    return DOC_TOKEN_BUDGET
 
 # ============== OCR (imágenes con texto) ==============
+def preprocess_for_ocr(img):
+    """Gris + resolución acotada + binarizado: Tesseract termina mucho antes."""
+    from PIL import Image, ImageOps
+    img = img.convert("L")
+    if max(img.size) > OCR_MAX_EDGE:
+        img.thumbnail((OCR_MAX_EDGE, OCR_MAX_EDGE), Image.LANCZOS)
+    img = ImageOps.autocontrast(img)
+    return img.point(lambda p: 255 if p > 150 else 0, mode="1")
+
+def ocr_image(img, lang: str = "spa"):
+    """OCR sobre una imagen ya preprocesada (picklable: se usa en el pool de procesos)."""
+    try:
+        import pytesseract
+        return pytesseract.image_to_string(img, lang=lang).strip()
+    except Exception as e:
+        return f"[OCR] Error: {e}"
+
 def ocr_from_bytes(data: bytes, lang: str = "spa"):
     try:
-        img = Image.open(BytesIO(data))
-        text = pytesseract.image_to_string(img, lang=lang)
-        return text.strip()
+        from PIL import Image, ImageOps
+        img = preprocess_for_ocr(ImageOps.exif_transpose(Image.open(BytesIO(data))))
     except Exception as e:
         return f"[OCR] Error: {e}"
+    return ocr_image(img, lang=lang)
+
+def _get_ocr_pool():
+    global _OCR_POOL
+    if _OCR_POOL is None:
+        _OCR_POOL = _process_pool(OCR_PROCESSES)
+    return _OCR_POOL
+
+def _ocr_ok(ocr_text: str) -> bool:
+    return bool(ocr_text) and not ocr_text.startswith("[OCR] Error") and len(ocr_text) > 20
 
 # ============== Imagen: Visión + OCR (con bytes) ==============
 def image_bytes_to_data_url(content_type: str, data: bytes) -> str:
@@ -105,50 +406,218 @@ def image_bytes_to_data_url(content_type: str, data: bytes) -> str:
     b64 = base64.b64encode(data).decode("utf-8")
     return f"data:{ct};base64,{b64}"
 
+class PreparedImage(NamedTuple):
+    image: object       # PIL.Image decodificada y orientada (None si no se pudo decodificar)
+    data_url: str
+    detail: str         # low | high
+    nbytes: int         # bytes que se suben al LLM (antes de base64)
+
+def prepare_image(content_type: str, data: bytes) -> PreparedImage:
+    """
+    Decodifica una sola vez (con orientación EXIF), reduce a VISION_MAX_EDGE y recomprime.
+    La imagen decodificada se reutiliza para el OCR.
+    """
+    try:
+        from PIL import Image, ImageOps
+        img = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+        img.load()
+    except Exception:
+        # formato que Pillow no abre: se envía tal cual
+        return PreparedImage(None, image_bytes_to_data_url(content_type, data), "auto", len(data))
+
+    small = img
+    if max(img.size) > VISION_MAX_EDGE:
+        small = img.copy()
+        small.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS)
+    if small.mode not in ("RGB", "L"):
+        small = small.convert("RGB")
+    fmt = "WEBP" if VISION_FORMAT == "WEBP" else "JPEG"
+    buf = BytesIO()
+    small.save(buf, format=fmt, quality=VISION_QUALITY, optimize=True)
+    out = buf.getvalue()
+    if len(out) >= len(data) and img is small:
+        # ya era pequeña y recomprimir no ayuda: se envía el original
+        out, ct = data, content_type
+    else:
+        ct = f"image/{fmt.lower()}"
+
+    detail = VISION_DETAIL
+    if detail == "auto":
+        detail = "low" if max(small.size) <= VISION_LOW_EDGE else "high"
+    return PreparedImage(img, image_bytes_to_data_url(ct, out), detail, len(out))
+
 def analyze_image_bytes(content_type: str, data: bytes, goal: str = "analiza y resuelve si es un ejercicio"):
     """
     1) Construye data URL base64 (pública para el LLM) y usa Visión.
     2) Si el resultado es pobre, aplica OCR y resume/explica.
+    Con IMAGE_SPECULATIVE_OCR=1 el OCR arranca en paralelo a la visión (pool de procesos):
+    si la visión basta se cancela/descarta; si no, el texto ya está listo.
     """
     system = (
         "Eres un tutor escolar. Analiza la imagen (foto de tarea, problema, gráfico o texto) "
         "y explica claro, paso a paso. Si falta info, dilo y sugiere cómo completarla."
     )
-    data_url = image_bytes_to_data_url(content_type, data)
+    with stage("image_prepare"):
+        prepared = prepare_image(content_type, data)
     user_content = [
         {"type": "text", "text": f"Objetivo: {goal}"},
-        {"type": "image_url", "image_url": {"url": data_url}}
+        {"type": "image_url", "image_url": {"url": prepared.data_url, "detail": prepared.detail}}
     ]
 
+    ocr_pool = ocr_future = None
+    if IMAGE_SPECULATIVE_OCR and prepared.image is not None:
+        try:
+            # al proceso se envía la imagen ya binarizada (pequeña), no los bytes originales
+            ocr_pool = _get_ocr_pool()
+            ocr_future = ocr_pool.submit(ocr_image, preprocess_for_ocr(prepared.image), "spa")
+        except BrokenProcessPool:
+            _drop_pool(ocr_pool)
+            ocr_future = None
+        except Exception:
+            ocr_future = None
+
+    def ocr_affordable() -> bool:
+        # el fallback es OCR + otra llamada al LLM: sin tiempo, se queda lo que dio la visión
+        left = deadline.remaining()
+        if left is not None and left < OCR_FALLBACK_SECONDS:
+            deadline.plan("ocr", "skip", left_s=round(left, 2))
+            if ocr_future is not None:
+                ocr_future.cancel()   # no se va a usar: que no ocupe el pool
+            return False
+        return True
+
+    def get_ocr():
+        count("ocr_fallback")
+        with stage("ocr"):
+            if ocr_future is not None:
+                try:
+                    # el OCR especulativo tampoco puede pasarse del deadline
+                    return ocr_future.result(timeout=deadline.remaining())
+                except FutureTimeout:
+                    ocr_future.cancel()
+                    deadline.plan("ocr", "timeout")
+                    return "[OCR] Error: sin tiempo para terminar el OCR"
+                except BrokenProcessPool:
+                    _drop_pool(ocr_pool)   # y OCR en este hilo, como sin especulativo
+                except Exception as e:
+                    return f"[OCR] Error: {e}"
+            if prepared.image is not None:
+                return ocr_image(preprocess_for_ocr(prepared.image), lang="spa")
+            return ocr_from_bytes(data, lang="spa")
+
     try:
-        vision_out = llm_answer(system, user_content)
-        if len(vision_out) < 120:
-            ocr_text = ocr_from_bytes(data, lang="spa")
-            if ocr_text and not ocr_text.startswith("[OCR] Error") and len(ocr_text) > 20:
-                analysis = summarize_text(ocr_text, "texto detectado por OCR en imagen")
+        with stage("vision"):
+            vision_out = llm_answer(system, user_content)
+        if len(vision_out) < 120 and ocr_affordable():
+            ocr_text = get_ocr()
+            if _ocr_ok(ocr_text):
+                with stage("ocr_llm"):
+                    analysis = summarize_text(ocr_text, "texto detectado por OCR en imagen")
                 return f"Texto detectado (OCR):\n{ocr_text[:600]}{'...' if len(ocr_text)>600 else ''}\n\nAnálisis:\n{analysis}"
+        if ocr_future is not None and len(vision_out) >= 120:
+            ocr_future.cancel()   # la visión ganó: si el OCR ya corre, su resultado se descarta
+            count("ocr_speculative_discarded")
         return vision_out
+    except Overloaded:
+        if ocr_future is not None:
+            ocr_future.cancel()
+        raise   # saturado: el fallback OCR también necesitaría el LLM
     except Exception as e:
-        ocr_text = ocr_from_bytes(data, lang="spa")
-        if ocr_text and not ocr_text.startswith("[OCR] Error") and len(ocr_text) > 20:
-            analysis = summarize_text(ocr_text, "texto detectado por OCR (fallback)")
+        ocr_text = get_ocr() if ocr_affordable() else ""
+        if _ocr_ok(ocr_text):
+            with stage("ocr_llm"):
+                analysis = summarize_text(ocr_text, "texto detectado por OCR (fallback)")
             return f"[Visión falló: {e}]\n\nTexto (OCR):\n{ocr_text[:600]}{'...' if len(ocr_text)>600 else ''}\n\nAnálisis:\n{analysis}"
         return f"No pude analizar la imagen todavía 🤕 Detalle: {e}"
 
 # ============== Tareas escolares (texto) ==============
-def summarize_text(text: str, focus: str = "resumen claro para estudiante"):
+def summarize_text(text: str, focus: str = "resumen claro para estudiante", on_segment=None,
+                   max_tokens: int = ANSWER_TOKENS):
     prompt = (
         f"Resume en español con puntos clave y ejemplos si aplica. "
         f"Concluye en 1-2 líneas. Enfócate en: {focus}. "
         f"Si hay listas, usa viñetas."
     )
-    return llm_answer(prompt, text)
+    return llm_answer(prompt, text, on_segment=on_segment, max_tokens=max_tokens)
 
-def explain_text(text: str, instruction: str = "explica paso a paso"):
+def explain_text(text: str, instruction: str = "explica paso a paso", on_segment=None):
     prompt = (
         "Explica en español como para un estudiante de secundaria, paso a paso, "
         "claro y conciso. Incluye ejemplos simples si ayuda. "
         "Si hay fórmulas, escríbelas en texto plano."
     )
     user = f"Instrucción: {instruction}\n\nTexto:\n{text}"
-    return llm_answer(prompt, user)
+    return llm_answer(prompt, user, on_segment=on_segment)
+
+# ============== Documentos largos (map-reduce) ==============
+_MAP_POOL = ThreadPoolExecutor(max_workers=MAP_POOL_WORKERS, thread_name_prefix="akira-map")
+_PARA_SPLIT = re.compile(r"\f|\n\s*\n")   # saltos de página (pdfminer) o de párrafo
+
+def split_paragraphs(text: str, max_chars: int = DOC_CHUNK_CHARS):
+    """Agrupa páginas/párrafos en trozos de hasta max_chars sin cortarlos por la mitad."""
+    chunks, cur, size = [], [], 0
+    for para in _PARA_SPLIT.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) > max_chars:   # párrafo gigante: se parte igual que chunk_text
+            pieces = chunk_text(para, max_chars)
+        else:
+            pieces = [para]
+        for p in pieces:
+            if size + len(p) > max_chars and cur:
+                chunks.append("\n\n".join(cur))
+                cur, size = [], 0
+            cur.append(p)
+            size += len(p) + 2
+    if cur:
+        chunks.append("\n\n".join(cur))
+    return chunks
+
+def _summarize_chunk(chunk: str, i: int, total: int, mode: str):
+    focus = "ideas, definiciones y pasos clave" if mode == "explicar" else "puntos clave para estudiar"
+    # resúmenes parciales cortos: la pasada final debe caber en su presupuesto
+    with stage("doc_map"):
+        return summarize_text(chunk, f"parte {i+1} de {total} de un documento; {focus}",
+                              max_tokens=MAP_ANSWER_TOKENS)
+
+def process_document_text(text: str, mode: str = "resumen", on_segment=None,
+                          token_budget: int = DOC_TOKEN_BUDGET):
+    """
+    Resume/explica un documento. Si cabe en un trozo va directo; si no, map-reduce:
+    resúmenes parciales en paralelo (máx. DOC_CONCURRENCY a la vez) y una pasada final.
+    token_budget: entrada máxima (doc_token_budget() lo baja si queda poco tiempo).
+    """
+    # Presupuesto total de entrada: lo que sobra no se envía
+    text = truncate_to_tokens(text, token_budget)
+    chunks = split_paragraphs(text)
+    if len(chunks) <= 1:
+        with stage("doc_llm"):
+            if mode == "explicar":
+                return explain_text(text, "explica paso a paso", on_segment=on_segment)
+            return summarize_text(text, "resumen para estudiar", on_segment=on_segment)
+
+    count("doc_chunks", len(chunks))
+
+    gate = threading.BoundedSemaphore(max(1, DOC_CONCURRENCY))
+    futures = []
+    for i, chunk in enumerate(chunks):
+        gate.acquire()
+        # propagate: los tiempos/tokens del hilo del pool van a la traza de este request
+        f = _MAP_POOL.submit(propagate(_summarize_chunk), chunk, i, len(chunks), mode)
+        f.add_done_callback(lambda _f: gate.release())
+        futures.append(f)
+    partials = []
+    for i, f in enumerate(futures):
+        try:
+            partials.append(f"[Parte {i+1}]\n{f.result()}")
+        except Exception as e:
+            partials.append(f"[Parte {i+1}] (no se pudo resumir: {e})")
+
+    combined = "\n\n".join(partials)
+    with stage("doc_reduce"):
+        if mode == "explicar":
+            return explain_text(combined, "explica paso a paso el documento completo a partir de estos resúmenes por partes",
+                                on_segment=on_segment)
+        return summarize_text(combined, "resumen para estudiar del documento completo (une los resúmenes por partes)",
+                              on_segment=on_segment)
@@ -1,19 +1,191 @@
 # app_twilio.py — Akira WhatsApp (IA + docs + imágenes) sin eco, robusto
 import os
-import requests
+import threading
+import time
 from flask import Flask, request, Response
-from dotenv import load_dotenv
 from twilio.twiml.messaging_response import MessagingResponse
 
-from akira_brain import akira_reply
+# El .env va antes que los módulos del proyecto: leen su configuración al importarse.
+# python-dotenv solo se importa si hay archivo (en Render las variables vienen del panel).
+_ENV_FILE = next((p for p in (".env", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+                  if os.path.exists(p)), None)
+if _ENV_FILE:
+    from dotenv import load_dotenv
+    load_dotenv(_ENV_FILE)
+
+import admission
+import deadline
+from admission import BUCKETS, COST, Overloaded
+from akira_brain import MEM, akira_reply
 from analyzer import analyze_image_bytes, handle_document_bytes, split_for_whatsapp
+from analyzer import prewarm as prewarm_media
+from idempotency import Idempotency, InFlightTimeout
+from jobs import JobQueue
+from llm_cache import CACHE as LLM_CACHE
+from llm_client import get_client, pool_stats
+from media_fetch import MediaRejected, make_fetcher
+from outbound import make_sender
+from telemetry import REGISTRY, count, current as current_trace, stage, trace
+from token_budget import count_tokens
 
-load_dotenv()
 app = Flask(__name__)
 
 # Credenciales para descargar media protegida desde Twilio
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN  = os.getenv("TWILIO_AUTH_TOKEN")
+FETCHER = make_fetcher(auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
+
+# Modo asíncrono: el webhook responde 200 vacío al instante y los workers contestan
+# por la API REST de Twilio (evita el timeout 11200 con PDFs/imágenes lentos)
+ASYNC_REPLIES = os.getenv("AKIRA_ASYNC_REPLIES", "0") == "1"
+WORKERS       = int(os.getenv("AKIRA_WORKERS", "4"))
+QUEUE_MAX     = int(os.getenv("AKIRA_QUEUE_MAX", "100"))
+# Streaming (solo en modo asíncrono): cada parte se envía en cuanto el LLM la completa
+STREAM_REPLIES = ASYNC_REPLIES and os.getenv("AKIRA_STREAM_REPLIES", "0") == "1"
+
+# Idempotencia por MessageSid: los reintentos de Twilio no repiten descarga/LLM/memoria
+IDEMP = Idempotency(ttl=float(os.getenv("AKIRA_IDEMP_TTL", "600")),
+                    lease=float(os.getenv("AKIRA_IDEMP_LEASE", "300")))   # tope de un mensaje en vuelo
+RETRY_WAIT = float(os.getenv("AKIRA_RETRY_WAIT", "12"))   # < 15 s de timeout de Twilio
+
+JOBS = JobQueue(workers=WORKERS, max_depth=QUEUE_MAX) if ASYNC_REPLIES else None
+SENDER = make_sender() if ASYNC_REPLIES else None
+
+# Pre-warm opcional en segundo plano al llegar el primer request (el server ya escucha):
+# conexión al LLM, tokenizer y librerías de media, para que el primer mensaje no lo pague
+PREWARM = os.getenv("AKIRA_PREWARM", "0") == "1"
+_PREWARM_ONCE = threading.Lock()   # se adquiere una vez y no se suelta
+
+BUSY_MEDIA_REPLY = "Estoy con mucha gente ahora mismo 🐾 Reenvíame el archivo en un minutito, porfa."
+LATE_MEDIA_REPLY = "Se me acabó el tiempo con ese archivo 🐾 Reenvíamelo o prueba con uno más corto, porfa."
+
+# Gauges de /metrics: estado de cada componente en el momento del scrape
+REGISTRY.collect("admission", admission.metrics)
+REGISTRY.collect("llm_cache", LLM_CACHE.metrics)
+REGISTRY.collect("llm_pool", pool_stats)
+REGISTRY.collect("media", FETCHER.metrics)
+REGISTRY.collect("memory", MEM.stats)
+REGISTRY.collect("idempotency", lambda: IDEMP.stats)
+if JOBS is not None:
+    REGISTRY.collect("jobs", lambda: {**JOBS.stats, "depth": JOBS.depth()})
+
+def prewarm():
+    t0 = time.perf_counter()
+    steps = (
+        ("llm", lambda: get_client().models.list()),   # abre la conexión TLS del pool
+        ("tokenizer", lambda: count_tokens("hola")),
+        ("media", prewarm_media),
+    )
+    for name, fn in steps:
+        try:
+            with stage(f"prewarm_{name}"):
+                fn()
+        except Exception as e:
+            print(f">>> PREWARM {name} falló:", repr(e))
+    print(f">>> PREWARM listo en {time.perf_counter() - t0:.2f}s")
+
+@app.before_request
+def _start_prewarm():
+    if PREWARM and _PREWARM_ONCE.acquire(blocking=False):
+        threading.Thread(target=prewarm, name="akira-prewarm", daemon=True).start()
+
+def process_message(form, send=None) -> list:
+    """
+    Procesa un mensaje entrante de Twilio y devuelve las partes de la respuesta.
+    Si se pasa send(parte), texto y documentos se entregan en streaming por ahí y solo
+    se devuelve lo que quede por enviar.
+    """
+    from_number = form.get("From", "")
+    body        = form.get("Body", "") or ""
+    num_media   = int(form.get("NumMedia", "0") or 0)
+
+    # Admisión por usuario: quien manda ráfagas recibe una respuesta barata. Solo gasta
+    # cupo lo que va al LLM: la media aquí (antes de descargarla) y el texto en akira_reply,
+    # después de heurísticas y caché (un saludo no cuenta)
+    kind = "text"
+    if num_media > 0:
+        kind = "image" if form.get("MediaContentType0", "").startswith("image/") else "document"
+    t = current_trace()
+    if t is not None:
+        t.set(kind=kind)   # el histograma de requests se etiqueta por tipo
+    if kind != "text" and not _admit(from_number, kind):
+        return [BUSY_MEDIA_REPLY]
+
+    try:
+        return _process(form, from_number, body, num_media, send)
+    except Overloaded as e:
+        print(">>> SHED (global):", e.reason)
+        count("shed_global")
+        return [LATE_MEDIA_REPLY if e.reason == "deadline" else BUSY_MEDIA_REPLY]
+
+def _admit(from_number: str, kind: str) -> bool:
+    if BUCKETS.allow(from_number, COST[kind]):
+        return True
+    print(">>> SHED (usuario):", from_number, kind)
+    count("shed_user")
+    return False
+
+def _process(form, from_number: str, body: str, num_media: int, send=None) -> list:
+    # 1) Si viene archivo (imagen/pdf/docx/txt) lo procesamos
+    if num_media > 0:
+        media_url = form.get("MediaUrl0")
+        media_ct  = form.get("MediaContentType0", "")
+        print(">>> MEDIA:", media_url, media_ct)
+
+        # Descargar media con auth (requerido por Twilio): sesión reutilizada, con tope de tamaño
+        try:
+            with stage("media_fetch"):
+                media = FETCHER.fetch(media_url, expected_type=media_ct, timeout=deadline.remaining())
+        except MediaRejected as e:
+            count("media_rejected")
+            return [f"No puedo procesar ese archivo 🐾 {e}. Prueba con una foto, PDF, DOCX o TXT."]
+        data = media.data
+        print(f">>> MEDIA OK: {media.size} bytes en {media.seconds:.2f}s")
+
+        # Imagen → visión (y OCR si está disponible dentro de analyzer)
+        if media_ct.startswith("image/"):
+            # Si el usuario escribió algo junto con la imagen, úsalo como objetivo
+            goal = body.strip() or "Analiza y resuelve si es una tarea; explica paso a paso."
+            out_text = analyze_image_bytes(media_ct, data, goal=goal)
+            return split_for_whatsapp(out_text)
+
+        # Documento → sacamos texto y pedimos resumen/explicación
+        mode = "resumen"
+        bl = body.lower()
+        if any(k in bl for k in ["explica", "explícame", "explicame", "explicar"]):
+            mode = "explicar"
+        return handle_document_bytes(media_ct, data, mode=mode, on_segment=send)
+
+    # 2) Texto normal → pasa por el cerebro de Akira (memoria ligera por usuario)
+    reply = akira_reply(from_number, body, on_segment=send, admit=lambda: _admit(from_number, "text"))
+    return [] if send else split_for_whatsapp(reply)
+
+def _process_and_send(form: dict):
+    """Trabajo de fondo: procesa y responde fuera de banda."""
+    to, from_ = form.get("From", ""), form.get("To") or None
+    sid = form.get("MessageSid", "")
+    send = (lambda p: SENDER.send(to, p, from_=from_)) if STREAM_REPLIES else None
+    # el deadline cuenta desde que llegó el webhook (incluye la espera en la cola)
+    expires = form.pop("_expires", None) or deadline.expires_at(deadline.JOB_BUDGET)
+    try:
+        with trace("job", sid=sid, user=to), deadline.budget(expires=expires):
+            try:
+                parts = process_message(form, send=send)
+            except Exception as e:
+                print(">>> ERROR en job:", repr(e))
+                count("job_error")
+                parts = [f"Ups, tuve un problema procesando tu mensaje 🤕\nDetalle: {e}"]
+            with stage("send"):
+                for p in parts:
+                    SENDER.send(to, p, from_=from_)
+    except BaseException as e:
+        # p. ej. error de la API REST de Twilio: se libera el MessageSid para un reintento
+        count("send_error")
+        if sid:
+            IDEMP.fail(sid, e)
+        raise
+    if sid:
+        IDEMP.finish(sid, parts)
 
 @app.route("/whatsapp", methods=["POST", "GET"])
 def whatsapp_webhook():
@@ -21,57 +193,56 @@ def whatsapp_webhook():
     if request.method == "GET":
         return "Akira WhatsApp webhook vivo (usa POST desde Twilio)", 200
 
+    form = request.form
+    # Deadline del request: en síncrono debe caber en el timeout de Twilio
+    with trace("webhook", sid=form.get("MessageSid", ""), user=form.get("From", "")), \
+            deadline.budget(deadline.REQUEST_BUDGET):
+        return _webhook(form)
+
+def _webhook(form):
     resp = MessagingResponse()
     try:
-        form = request.form
-        from_number = form.get("From", "")
-        body        = form.get("Body", "") or ""
-        num_media   = int(form.get("NumMedia", "0") or 0)
-
         # Logs útiles (se ven en Render → Logs)
         print(">>> HIT /whatsapp")
-        print(">>> FROM:", from_number)
-        print(">>> BODY:", body)
-        print(">>> NUM_MEDIA:", num_media)
-
-        # 1) Si viene archivo (imagen/pdf/docx/txt) lo procesamos
-        if num_media > 0:
-            media_url = form.get("MediaUrl0")
-            media_ct  = form.get("MediaContentType0", "")
-            print(">>> MEDIA:", media_url, media_ct)
-
-            # Descargar media con auth (requerido por Twilio)
-            r = requests.get(media_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN), timeout=30)
-            r.raise_for_status()
-            data = r.content
-
-            # Imagen → visión (y OCR si está disponible dentro de analyzer)
-            if media_ct.startswith("image/"):
-                # Si el usuario escribió algo junto con la imagen, úsalo como objetivo
-                goal = body.strip() or "Analiza y resuelve si es una tarea; explica paso a paso."
-                out_text = analyze_image_bytes(media_ct, data, goal=goal)
-                parts = split_for_whatsapp(out_text)
-            else:
-                # Documento → sacamos texto y pedimos resumen/explicación
-                mode = "resumen"
-                bl = body.lower()
-                if any(k in bl for k in ["explica", "explícame", "explicame", "explicar"]):
-                    mode = "explicar"
-                parts = handle_document_bytes(media_ct, data, mode=mode)
+        print(">>> FROM:", form.get("From", ""))
+        print(">>> BODY:", form.get("Body", ""))
+        print(">>> NUM_MEDIA:", form.get("NumMedia", "0"))
 
-            for p in parts:
-                resp.message(p)
+        sid = form.get("MessageSid", "")
+
+        if JOBS is not None:
+            # Reintento de un mensaje ya aceptado: la respuesta sale (o salió) por REST
+            if sid and not IDEMP.acquire(sid)[1]:
+                print(">>> DUPLICADO:", sid)
+                count("duplicate")
+                return Response(str(resp), mimetype="application/xml", status=200)
+            # Copiamos el form: el request deja de existir al responder
+            job = form.to_dict()
+            job["_expires"] = deadline.expires_at(deadline.JOB_BUDGET)
+            if not JOBS.submit(job.get("From", ""), _process_and_send, job):
+                if sid:
+                    IDEMP.fail(sid, RuntimeError("cola llena"))
+                count("queue_full")
+                resp.message("Estoy atendiendo muchos mensajes 🐾 Reintenta en un minuto, porfa.")
             return Response(str(resp), mimetype="application/xml", status=200)
 
-        # 2) Texto normal → pasa por el cerebro de Akira (memoria ligera por usuario)
-        reply = akira_reply(from_number, body)
-        for p in split_for_whatsapp(reply):
-            resp.message(p)
-        return Response(str(resp), mimetype="application/xml", status=200)
+        # Síncrono: si es un reintento, espera/reproduce el resultado del original
+        try:
+            parts = IDEMP.run(sid, lambda: process_message(form), timeout=RETRY_WAIT)
+        except InFlightTimeout:
+            print(">>> DUPLICADO en curso:", sid)
+            count("duplicate")
+            return Response(str(resp), mimetype="application/xml", status=200)
+        with stage("twiml"):
+            for p in parts:
+                resp.message(p)
+            xml = str(resp)
+        return Response(xml, mimetype="application/xml", status=200)
 
     except Exception as e:
         # Pase lo que pase, respondemos 200 (evita timeout 11200 en Twilio)
         print(">>> ERROR en /whatsapp:", repr(e))
+        count("webhook_error")
         resp.message(f"Ups, tuve un problema procesando tu mensaje 🤕\nDetalle: {e}")
         return Response(str(resp), mimetype="application/xml", status=200)
 
@@ -83,6 +254,11 @@ def home():
 def health():
     return "OK", 200
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Formato de texto de Prometheus (histogramas por etapa + contadores + gauges)."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,66 @@
+# bench_context.py — Coste por mensaje de armar el prompt (antes vs. después)
+#   python bench/bench_context.py
+import os
+import sys
+import time
+import timeit
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from akira_brain import Memory, SYSTEM_PROMPT  # noqa: E402
+
+MSG = "¿me explicas cómo se resuelve una ecuación de segundo grado con un ejemplo?"
+
+
+def legacy_messages(u: dict, text: str):
+    """Versión anterior: reconstruye likes + historial con += en cada mensaje."""
+    likes = ", ".join(u["likes"]) if u["likes"] else "—"
+    history = ""
+    for t in u["turns"]:
+        who = "Usuario" if t["role"] == "user" else "Akira"
+        history += f"{who}: {t['content']}\n"
+    context = f"Gustos del usuario: {likes}\nHistorial reciente:\n{history}".strip()
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": f"Estado percibido del usuario: {u['mood']}"},
+        {"role": "system", "content": f"Contexto persistente:\n{context}"},
+        {"role": "user", "content": text},
+    ]
+
+
+def run(turns: int, n: int = 20000):
+    """
+    Coste por mensaje en ambos lados: 2 turnos nuevos (user + assistant) + armar el prompt.
+    El historial llega lleno a max_turns, así que también se paga la expulsión del más viejo.
+    """
+    legacy = {"likes": ["gatos", "fútbol", "anime"], "mood": "neutral",
+              "turns": deque(maxlen=turns)}
+    mem = Memory(max_turns=turns)
+    for thing in legacy["likes"]:
+        mem.add_like("u", thing)
+    for i in range(turns):
+        role = "user" if i % 2 == 0 else "assistant"
+        legacy["turns"].append({"role": role, "content": MSG, "ts": 0.0})
+        mem.add_turn("u", role, MSG)
+
+    def legacy_message():
+        legacy["turns"].append({"role": "user", "content": MSG, "ts": time.time()})
+        legacy_messages(legacy, MSG)
+        legacy["turns"].append({"role": "assistant", "content": MSG, "ts": time.time()})
+
+    def message():
+        mem.add_turn("u", "user", MSG)
+        [{"role": "system", "content": SYSTEM_PROMPT},
+         *mem.get_prompt_messages("u"),
+         {"role": "user", "content": MSG}]
+        mem.add_turn("u", "assistant", MSG)
+
+    before = min(timeit.repeat(legacy_message, number=n, repeat=3)) / n
+    after = min(timeit.repeat(message, number=n, repeat=3)) / n
+    print(f"turnos={turns:4d}  antes={before * 1e6:8.2f} µs  después={after * 1e6:8.2f} µs  "
+          f"(por mensaje: 2 turnos + prompt)")
+
+
+if __name__ == "__main__":
+    for turns in (12, 100, 200):
+        run(turns)
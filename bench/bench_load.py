@@ -0,0 +1,442 @@
+# bench_load.py — Carga sintética de webhooks de Twilio contra app_twilio (OpenAI y media locales)
+#   python bench/bench_load.py --concurrency 1,4,16 --duration 20 --llm-latency lognormal:0.8,0.5
+#   python bench/bench_load.py --out bench/results/nuevo.json --compare bench/results/viejo.json
+#
+# Levanta en 127.0.0.1:
+#   - un stub de la API de OpenAI (/v1/chat/completions, con y sin stream) con latencia aleatoria
+#   - un LocalMediaServer con una imagen, un PDF y un DOCX sintéticos (las "MediaUrl" de Twilio)
+#   - la app Flask (modo síncrono: la latencia medida es la del webhook completo)
+# y le envía POST /whatsapp desde N hilos. Escribe throughput y p50/p95/p99 por tipo y
+# concurrencia en JSON, para comparar entre commits. Las respuestas de error de la app
+# ("Ups, tuve un problema...") cuentan como errores, y cada nivel comprueba que el stub
+# haya recibido al menos una llamada por mensaje que debía ir al LLM: si la app no llega
+# al LLM (p. ej. falta openai) el benchmark falla en vez de medir respuestas de error.
+import argparse
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zipfile
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEXTS = [
+    "¿me explicas cómo se resuelve una ecuación de segundo grado con un ejemplo?",
+    "dame ideas para una exposición sobre el ciclo del agua",
+    "¿qué diferencia hay entre célula animal y vegetal?",
+    "ayúdame a organizar mi semana de exámenes",
+]
+GREETINGS = ["hola", "holi akira", "buenas!", "hey"]   # los atrapa _quick_heuristics
+NO_LLM = {"greet"}   # tipos que no llaman al LLM; el resto hace al menos una llamada
+
+# Respuestas de error de la app (akira_reply, analyzer, app_twilio): no son respuestas servidas
+ERROR_MARKERS = ("Ups, tuve un problema", "Ups, no pude pensar", "No pude ")
+
+LOREM = ("La fotosíntesis es el proceso por el cual las plantas transforman la luz en energía "
+         "química. Ocurre en los cloroplastos y libera oxígeno. ")
+
+
+# ============== Stub de OpenAI ==============
+def parse_latency(spec: str):
+    """fixed:S | uniform:A,B | lognormal:MEDIANA,SIGMA | exp:MEDIA  →  función que da segundos."""
+    kind, _, args = spec.partition(":")
+    vals = [float(x) for x in args.split(",") if x]
+    if kind == "fixed":
+        return lambda: vals[0]
+    if kind == "uniform":
+        return lambda: random.uniform(vals[0], vals[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(vals[0]), vals[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1 / vals[0])
+    raise ValueError(f"latencia no soportada: {spec}")
+
+
+class StubOpenAI:
+    """
+    Responde a chat.completions como la API real (mismo JSON / SSE). La latencia total
+    sale de `latency()`; en streaming se reparte: primer token tras ttft_ratio y el resto
+    en chunks de ~chunk_words palabras.
+    """
+
+    def __init__(self, latency, reply_words: int = 180, ttft_ratio: float = 0.3, chunk_words: int = 6):
+        stub = self
+        self.latency = latency
+        self.reply_words = reply_words
+        self.ttft_ratio = ttft_ratio
+        self.chunk_words = chunk_words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, como la API real
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                with stub._lock:
+                    stub.calls += 1
+                if body.get("stream"):
+                    stub._stream(self, body)
+                else:
+                    stub._complete(self, body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _words(self, body) -> list:
+        n = min(self.reply_words, int(body.get("max_tokens") or self.reply_words))
+        return (LOREM.split() * (n // 10 + 1))[:n]
+
+    @staticmethod
+    def _usage(body, words) -> dict:
+        prompt = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": len(words),
+                "total_tokens": prompt + len(words)}
+
+    def _complete(self, h, body):
+        words = self._words(body)
+        time.sleep(self.latency())
+        out = json.dumps({
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": " ".join(words)}}],
+            "usage": self._usage(body, words),
+        }).encode()
+        h.send_response(200)
+        h.send_header("Content-Type", "application/json")
+        h.send_header("Content-Length", str(len(out)))
+        h.end_headers()
+        h.wfile.write(out)
+
+    def _stream(self, h, body):
+        words = self._words(body)
+        total = self.latency()
+        h.send_response(200)
+        h.send_header("Content-Type", "text/event-stream")
+        h.send_header("Transfer-Encoding", "chunked")
+        h.end_headers()
+
+        def event(payload: dict | str):
+            data = payload if isinstance(payload, str) else json.dumps(payload)
+            raw = f"data: {data}\n\n".encode()
+            h.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+            h.wfile.flush()
+
+        base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body.get("model", "gpt-4o-mini")}
+        time.sleep(total * self.ttft_ratio)
+        pieces = [words[i:i + self.chunk_words] for i in range(0, len(words), self.chunk_words)]
+        gap = total * (1 - self.ttft_ratio) / max(1, len(pieces))
+        for i, p in enumerate(pieces):
+            text = (" " if i else "") + " ".join(p)
+            event({**base, "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]})
+            time.sleep(gap)
+        event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            event({**base, "choices": [], "usage": self._usage(body, words)})
+        event("[DONE]")
+        h.wfile.write(b"0\r\n\r\n")
+
+
+# ============== Media sintética ==============
+def make_pdf(pages: int = 8) -> bytes:
+    """PDF mínimo válido con texto real en cada página (sin dependencias)."""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        lines = [f"Pagina {p + 1}"] + [LOREM.encode("ascii", "ignore").decode()[:90]] * 30
+        text = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(
+            f"({l.replace('(', '').replace(')', '')}) '" for l in lines) + " ET"
+        objs.append(f"<< /Length {len(text)} >>\nstream\n{text}\nendstream")
+        content = len(objs)
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content} 0 R >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out, offsets = io.BytesIO(), []
+    out.write(b"%PDF-1.4\n")
+    for i, o in enumerate(objs, 1):
+        offsets.append(out.tell())
+        out.write(f"{i} 0 obj\n{o}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode())
+    for off in offsets:
+        out.write(f"{off:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_docx(paragraphs: int = 40) -> bytes:
+    """DOCX mínimo (zip con document.xml) que python-docx sabe abrir."""
+    body = "".join(f"<w:p><w:r><w:t>{LOREM}</w:t></w:r></w:p>" for _ in range(paragraphs))
+    files = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-'
+            'officedocument.wordprocessingml.document.main+xml"/></Types>'),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="word/document.xml"/></Relationships>'),
+        "word/document.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f"<w:body>{body}</w:body></w:document>"),
+    }
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, xml in files.items():
+            z.writestr(name, xml)
+    return buf.getvalue()
+
+
+def make_image() -> bytes:
+    """Foto sintética de 'tarea' (1600x1200 con texto y ruido) en JPEG."""
+    from PIL import Image, ImageDraw
+    img = Image.new("RGB", (1600, 1200), "white")
+    d = ImageDraw.Draw(img)
+    for i in range(40):
+        d.text((60, 40 + i * 28), f"{i + 1}) resuelve x^2 - {i}x + {i * 2} = 0", fill="black")
+    for _ in range(4000):
+        d.point((random.randrange(1600), random.randrange(1200)), fill=(random.randrange(200),) * 3)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=88)
+    return buf.getvalue()
+
+
+MEDIA = {   # tipo -> (ruta, content-type)
+    "image": ("/tarea.jpg", "image/jpeg"),
+    "pdf": ("/apuntes.pdf", "application/pdf"),
+    "docx": ("/trabajo.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+}
+
+
+# ============== Carga ==============
+def percentile(xs: list, p: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    k = (len(xs) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def make_form(kind: str, user: str, media_url: str) -> dict:
+    form = {"From": user, "To": "whatsapp:+10000000000", "MessageSid": "SM" + uuid.uuid4().hex,
+            "NumMedia": "0", "Body": ""}
+    if kind == "text":
+        form["Body"] = random.choice(TEXTS)
+    elif kind == "greet":
+        form["Body"] = random.choice(GREETINGS)
+    else:
+        path, ct = MEDIA[kind]
+        form.update(NumMedia="1", MediaUrl0=media_url + path, MediaContentType0=ct)
+        if kind != "image":
+            form["Body"] = "resúmelo"
+    return form
+
+
+def run_level(app_url: str, media_url: str, mix: dict, concurrency: int, duration: float,
+              busy_markers: tuple, error_markers: tuple = ERROR_MARKERS) -> dict:
+    import requests
+    kinds, weights = zip(*mix.items())
+    lat = defaultdict(list)
+    errors, shed = defaultdict(int), defaultdict(int)
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(n: int):
+        s = requests.Session()
+        user = f"whatsapp:+5490000{n:05d}"
+        while time.perf_counter() < stop_at:
+            kind = random.choices(kinds, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                r = s.post(app_url + "/whatsapp", data=make_form(kind, user, media_url), timeout=120)
+                ok = r.status_code == 200 and not any(m in r.text for m in error_markers)
+                busy = ok and any(m in r.text for m in busy_markers)
+            except Exception:
+                ok, busy = False, False
+            dt = time.perf_counter() - t0
+            with lock:
+                if not ok:
+                    errors[kind] += 1
+                elif busy:
+                    shed[kind] += 1   # respondida con "estoy saturada": no cuenta como servida
+                else:
+                    lat[kind].append(dt)
+
+    t_start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t_start
+
+    per_type = {}
+    for kind in kinds:
+        xs = lat[kind]
+        per_type[kind] = {
+            "ok": len(xs), "errors": errors[kind], "shed": shed[kind],
+            "rps": round(len(xs) / elapsed, 3),
+            "mean_ms": round(1000 * sum(xs) / len(xs), 1) if xs else None,
+            **{f"p{int(p * 100)}_ms": round(1000 * percentile(xs, p), 1) if xs else None
+               for p in (0.50, 0.95, 0.99)},
+        }
+    served = sum(len(v) for v in lat.values())
+    return {"concurrency": concurrency, "seconds": round(elapsed, 2),
+            "rps": round(served / elapsed, 3), "per_type": per_type,
+            "llm_bound": sum(len(v) for k, v in lat.items() if k not in NO_LLM)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(new: dict, old_path: str):
+    """Imprime rps y p95 de ambos resultados, por concurrencia y tipo."""
+    with open(old_path) as f:
+        old = json.load(f)
+    old_levels = {lv["concurrency"]: lv for lv in old["levels"]}
+    print(f"\nComparación con {old_path} ({old.get('commit')}):")
+    for lv in new["levels"]:
+        prev = old_levels.get(lv["concurrency"])
+        if prev is None:
+            continue
+        for kind, cur in lv["per_type"].items():
+            ref = prev["per_type"].get(kind)
+            if not ref or not cur["p95_ms"] or not ref["p95_ms"]:
+                continue
+            print(f"  c={lv['concurrency']:3d} {kind:6s} rps {ref['rps']:8.2f} → {cur['rps']:8.2f}   "
+                  f"p95 {ref['p95_ms']:8.1f} → {cur['p95_ms']:8.1f} ms "
+                  f"({100 * (cur['p95_ms'] / ref['p95_ms'] - 1):+.0f}%)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Carga sintética de webhooks contra app_twilio")
+    ap.add_argument("--concurrency", default="1,4,16", help="niveles separados por coma")
+    ap.add_argument("--duration", type=float, default=20, help="segundos por nivel")
+    ap.add_argument("--mix", default="text=4,greet=3,image=1,pdf=1,docx=1")
+    ap.add_argument("--llm-latency", default="lognormal:0.8,0.5",
+                    help="fixed:S | uniform:A,B | lognormal:MEDIANA,SIGMA | exp:MEDIA")
+    ap.add_argument("--reply-words", type=int, default=180)
+    ap.add_argument("--stream", action="store_true", help="modo asíncrono con streaming (latencia = webhook)")
+    ap.add_argument("--cache", action="store_true", help="deja activa la caché de respuestas del LLM")
+    ap.add_argument("--pdf-pages", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=None,
+                    help="JSON de salida (por defecto bench/results/load-<commit>.json, ignorado por git)")
+    ap.add_argument("--compare", default=None, help="JSON anterior para comparar")
+    args = ap.parse_args()
+
+    random.seed(args.seed)
+    mix = {k: float(v) for k, v in (kv.split("=") for kv in args.mix.split(","))}
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    files = {MEDIA["pdf"][0]: (MEDIA["pdf"][1], make_pdf(args.pdf_pages)),
+             MEDIA["docx"][0]: (MEDIA["docx"][1], make_docx())}
+    if "image" in mix:
+        files[MEDIA["image"][0]] = (MEDIA["image"][1], make_image())
+
+    with StubOpenAI(parse_latency(args.llm_latency), reply_words=args.reply_words) as stub:
+        # La app lee su configuración al importarse: primero el entorno, luego el import
+        os.environ.update({
+            "OPENAI_API_KEY": "sk-bench",
+            "AKIRA_LLM_BASE_URL": stub.url,
+            "TWILIO_ACCOUNT_SID": "ACbench",
+            "TWILIO_AUTH_TOKEN": "bench",
+            "AKIRA_TRACE_LOG": "0",
+            "AKIRA_LLM_CACHE": "1" if args.cache else "0",
+            "ADMIT_USER_RATE": os.getenv("ADMIT_USER_RATE", "1000"),   # cada hilo es "un usuario"
+            "ADMIT_USER_BURST": os.getenv("ADMIT_USER_BURST", "1000"),
+            "AKIRA_OUTBOUND": "local",
+        })
+        if args.stream:
+            os.environ.update({"AKIRA_ASYNC_REPLIES": "1", "AKIRA_STREAM_REPLIES": "1"})
+        from media_fetch import LocalMediaServer
+        import app_twilio
+        from akira_brain import BUSY_REPLY
+        from werkzeug.serving import make_server
+
+        if app_twilio.SENDER is not None:
+            app_twilio.SENDER.echo = False
+        server = make_server("127.0.0.1", 0, app_twilio.app, threaded=True)
+        app_url = f"http://127.0.0.1:{server.server_port}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        busy = (BUSY_REPLY[:30], app_twilio.BUSY_MEDIA_REPLY[:30], "Estoy atendiendo muchos mensajes")
+
+        with LocalMediaServer(files) as media:
+            results, broken = [], False
+            for c in levels:
+                calls0 = stub.calls
+                lv = run_level(app_url, media.url, mix, c, args.duration, busy)
+                if app_twilio.JOBS is not None:
+                    app_twilio.JOBS.join(timeout=120)   # en asíncrono las llamadas siguen en la cola
+                lv["llm_calls"] = stub.calls - calls0
+                results.append(lv)
+                print(f"concurrencia={c:3d}  {lv['rps']:7.2f} msg/s  "
+                      f"llm_calls={lv['llm_calls']} (mensajes al LLM: {lv['llm_bound']})")
+                for kind, r in lv["per_type"].items():
+                    print(f"    {kind:6s} ok={r['ok']:5d} err={r['errors']:3d} shed={r['shed']:3d}  "
+                          f"p50={r['p50_ms']} p95={r['p95_ms']} p99={r['p99_ms']} ms")
+                # sin caché cada mensaje servido que no es saludo llamó al menos una vez al stub
+                if not args.cache and lv["llm_calls"] < lv["llm_bound"]:
+                    print("FALLA: el stub recibió menos llamadas que mensajes servidos por el LLM "
+                          "(¿la app responde con errores?)")
+                    broken = True
+        server.shutdown()
+        llm_calls = stub.calls
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {**vars(args), "mix": mix, "llm_calls": llm_calls},
+        "levels": results,
+    }
+    out = args.out or os.path.join(ROOT, "bench", "results", f"load-{report['commit']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print("Resultados:", out)
+    if args.compare:
+        compare(report, args.compare)
+    if broken:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
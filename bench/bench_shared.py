@@ -0,0 +1,88 @@
+# bench_shared.py — Mensajes/s de la memoria compartida (AKIRA_MEM_SHARED) según procesos e hilos
+#   python bench/bench_shared.py --procs 1,2,4 --threads 1,4 --duration 5
+#   python bench/bench_shared.py --url redis://localhost:6379/15
+#
+# Cada mensaje es lo que hace akira_reply con la memoria: add_turn (usuario),
+# get_prompt_messages y add_turn (Akira), contra un backend compartido real (por defecto un
+# SQLite WAL temporal). Los usuarios se eligen al azar entre --users, así que los procesos
+# compiten por las mismas filas como varios workers de gunicorn. Sin LLM: mide solo el coste
+# de leer/escribir estado, que es lo que los procesos no comparten en RAM.
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MSG = "¿me explicas cómo se resuelve una ecuación de segundo grado con un ejemplo?"
+
+
+def _worker(url: str, threads: int, users: int, duration: float, seed: int, out):
+    from akira_brain import Memory
+    from storage import open_shared
+    mem = Memory(backend=open_shared(url, max_turns=12))
+    done = [0] * threads
+    stop = time.monotonic() + duration
+
+    def loop(i: int):
+        rnd = random.Random(seed * 1000 + i)
+        while time.monotonic() < stop:
+            uid = f"u{rnd.randrange(users)}"
+            mem.add_turn(uid, "user", MSG)
+            mem.get_prompt_messages(uid)
+            mem.add_turn(uid, "assistant", MSG)
+            done[i] += 1
+
+    ts = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    out.put((sum(done), mem.stats().get("shared", {})))
+
+
+def run(url: str, procs: int, threads: int, users: int, duration: float):
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    ps = [ctx.Process(target=_worker, args=(url, threads, users, duration, i, out)) for i in range(procs)]
+    for p in ps:
+        p.start()
+    results = [out.get() for _ in ps]
+    for p in ps:
+        p.join()
+    total = sum(n for n, _ in results)
+    conflicts = sum(s.get("conflicts", 0) for _, s in results)
+    return total / duration, conflicts
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Throughput de la memoria compartida por procesos/hilos")
+    ap.add_argument("--url", default=None, help="sqlite:///ruta.db | redis://... (por defecto, SQLite temporal)")
+    ap.add_argument("--procs", default="1,2,4", help="niveles separados por coma")
+    ap.add_argument("--threads", default="1,4", help="hilos por proceso, separados por coma")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--duration", type=float, default=5, help="segundos por nivel")
+    args = ap.parse_args()
+
+    tmp = None
+    url = args.url
+    if url is None:
+        tmp = tempfile.mkdtemp(prefix="akira-bench-")
+    print(f"CPUs: {os.cpu_count()}  usuarios: {args.users}")
+    for threads in [int(x) for x in args.threads.split(",")]:
+        base = None
+        for procs in [int(x) for x in args.procs.split(",")]:
+            level_url = url or f"sqlite:///{os.path.join(tmp, f'p{procs}t{threads}.db')}"
+            rate, conflicts = run(level_url, procs, threads, args.users, args.duration)
+            base = base or rate
+            print(f"procesos={procs:2d} hilos={threads:2d}  {rate:9.0f} msg/s  "
+                  f"x{rate / base:4.2f} vs 1 proceso  conflictos={conflicts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# check_import_time.py — Presupuesto de arranque: importar app_twilio debe ser rápido
+#   python bench/check_import_time.py                # presupuesto por defecto
+#   python bench/check_import_time.py --budget 0.8   # segundos
+#
+# Mide `import app_twilio` en un intérprete nuevo (mejor de N) y comprueba que las
+# dependencias pesadas NO se hayan cargado todavía (se cargan al primer uso de cada tipo
+# de media o en el pre-warm). Sale con código 1 si se pasa del presupuesto o si alguna
+# se importa al arrancar, así se puede usar en CI.
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos que no deben cargarse al importar la app
+HEAVY = ("pdfminer", "docx", "pytesseract", "PIL", "openai", "httpx", "tiktoken")
+
+PROBE = f"""
+import json, sys, time
+t0 = time.perf_counter()
+import app_twilio
+secs = time.perf_counter() - t0
+print(json.dumps({{"seconds": secs,
+                   "loaded": [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+
+def measure() -> dict:
+    env = {**os.environ, "AKIRA_TRACE_LOG": "0", "AKIRA_PREWARM": "0"}
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Presupuesto de tiempo de import de app_twilio")
+    ap.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_BUDGET", "1.0")))
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    best = min(r["seconds"] for r in runs)
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    print(f"import app_twilio: {best * 1000:.0f} ms (mejor de {args.runs}; "
+          f"presupuesto {args.budget * 1000:.0f} ms)")
+
+    failed = False
+    if best > args.budget:
+        print("FALLA: el arranque se pasó del presupuesto")
+        failed = True
+    if loaded:
+        print("FALLA: dependencias pesadas importadas al arrancar:", ", ".join(loaded))
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# compaction.py — Resumen acumulado por usuario: los turnos que salen de la ventana se pliegan en él
+import os
+from typing import Sequence
+
+from admission import LLM_GATE
+from llm_client import get_client
+from telemetry import count, record_usage, stage
+
+# Así el prompt queda acotado (resumen + últimos turnos) por larga que sea la conversación.
+# Opcional (AKIRA_SUMMARY=1): cada FOLD_BATCH turnos expulsados es una llamada extra al LLM.
+SUMMARY_ENABLED = os.getenv("AKIRA_SUMMARY", "0") == "1"
+SUMMARY_TOKENS  = int(os.getenv("AKIRA_SUMMARY_TOKENS", "250"))   # tope del resumen
+FOLD_BATCH      = int(os.getenv("AKIRA_SUMMARY_BATCH", "4"))      # turnos expulsados por plegado
+FOLD_GATE_WAIT  = float(os.getenv("AKIRA_SUMMARY_GATE_WAIT", "2"))  # no le quita hueco a los requests
+
+FOLD_PROMPT = (
+    "Mantienes el resumen de una conversación entre un usuario y Akira (mascota IA). "
+    "Integra los turnos nuevos en el resumen actual. Conserva datos del usuario, temas, "
+    "tareas pendientes y acuerdos; omite saludos y relleno. Escribe en español, en tercera "
+    f"persona y en menos de {SUMMARY_TOKENS // 2} palabras. Devuelve solo el resumen."
+)
+
+
+def fold(summary: str, lines: Sequence[str]) -> str:
+    """
+    Nuevo resumen = resumen anterior + turnos que salieron de la ventana (llamada barata,
+    fuera del request). Si el LLM está saturado lanza Overloaded: se reintenta más tarde.
+    """
+    user = f"Resumen actual:\n{summary or '(vacío)'}\n\nTurnos nuevos:\n{''.join(lines)}"
+    with LLM_GATE.slot(timeout=FOLD_GATE_WAIT), stage("summary_fold"):
+        r = get_client().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "system", "content": FOLD_PROMPT},
+                      {"role": "user", "content": user}],
+            temperature=0.2,
+            max_tokens=SUMMARY_TOKENS,
+        )
+        record_usage(getattr(r, "usage", None))
+    count("summary_fold")
+    return (r.choices[0].message.content or "").strip() or summary
@@ -0,0 +1,74 @@
+# deadline.py — Presupuesto de tiempo por request: cada etapa mira cuánto queda y elige un plan
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+import telemetry
+from admission import Overloaded
+
+# Síncrono: Twilio corta a los 15 s; asíncrono: el usuario no debería esperar más de esto
+REQUEST_BUDGET = float(os.getenv("AKIRA_REQUEST_BUDGET", "12"))
+JOB_BUDGET     = float(os.getenv("AKIRA_JOB_BUDGET", "90"))
+MARGIN         = float(os.getenv("DEADLINE_MARGIN", "0.5"))     # armar TwiML/enviar + red
+
+# Modelo simple de una llamada al LLM: primer token + tokens/seg
+LLM_MIN_SECONDS    = float(os.getenv("DEADLINE_LLM_MIN", "1.5"))
+LLM_FIRST_TOKEN    = float(os.getenv("DEADLINE_FIRST_TOKEN", "0.8"))
+LLM_TOKENS_PER_SEC = float(os.getenv("DEADLINE_TOKENS_PER_SEC", "60"))
+
+_EXPIRES: contextvars.ContextVar = contextvars.ContextVar("akira_deadline", default=None)
+
+
+def expires_at(seconds: float) -> float:
+    return time.monotonic() + seconds
+
+
+@contextmanager
+def budget(seconds: float | None = None, expires: float | None = None):
+    """Fija el deadline del request en curso (también para los hilos que usen telemetry.propagate)."""
+    exp = expires if expires is not None else expires_at(seconds)
+    token = _EXPIRES.set(exp)
+    t = telemetry.current()
+    if t is not None:
+        t.set(budget_s=round(exp - time.monotonic(), 2))
+    try:
+        yield
+    finally:
+        _EXPIRES.reset(token)
+
+
+def remaining() -> float | None:
+    """Segundos útiles que quedan (ya descontado MARGIN); None si no hay deadline."""
+    exp = _EXPIRES.get()
+    if exp is None:
+        return None
+    return max(0.0, exp - time.monotonic() - MARGIN)
+
+
+def plan(what: str, choice: str, **detail):
+    """Anota en la traza (campo "plan") y en los contadores qué plan eligió una etapa."""
+    t = telemetry.current()
+    if t is not None:
+        t.fields.setdefault("plan", {})[what] = {"plan": choice, **detail} if detail else choice
+    telemetry.count(f"plan_{what}_{choice}")
+
+
+def llm_params(max_tokens: int, floor: int = 64):
+    """
+    (max_tokens, timeout) para una llamada al LLM según el tiempo que queda.
+    Sin tiempo para una llamada mínima lanza Overloaded("deadline"): el que llama ya sabe
+    responder barato en ese caso.
+    """
+    left = remaining()
+    if left is None:
+        return max_tokens, None
+    where = telemetry.current_stage() or "llm"
+    if left < LLM_MIN_SECONDS:
+        plan(where, "skip")
+        raise Overloaded("deadline")
+    fit = int((left - LLM_FIRST_TOKEN) * LLM_TOKENS_PER_SEC)
+    if fit < max_tokens:
+        max_tokens = max(min(floor, max_tokens), fit)
+        plan(where, "short", max_tokens=max_tokens, left_s=round(left, 2))
+    return max_tokens, left
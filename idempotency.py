@@ -0,0 +1,103 @@
+# idempotency.py — Un mensaje (MessageSid) se procesa una sola vez, aunque Twilio reintente
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class InFlightTimeout(Exception):
+    """El procesamiento original sigue en curso y no terminó dentro del tiempo de espera."""
+
+
+class _Entry:
+    __slots__ = ("done", "result", "error", "expires")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires = None   # en vuelo: fin del lease; al terminar: TTL del resultado
+
+
+class Idempotency:
+    """
+    - acquire(key): el primero es el dueño y hace el trabajo; los demás reciben la entrada
+    - Los reintentos mientras está en vuelo esperan al resultado (coalescing)
+    - Los resultados terminados se reproducen durante ttl segundos
+    - Si el dueño falla, la clave se libera para que un reintento pueda volver a intentarlo
+    - Una entrada en vuelo caduca a los lease segundos: un dueño colgado no bloquea la clave
+      (ni la purga) para siempre
+    """
+
+    def __init__(self, ttl: float = 600, max_entries: int = 10000, lease: float = 300):
+        self.ttl = ttl
+        self.lease = lease
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"owners": 0, "replayed": 0, "coalesced": 0, "failed": 0}
+
+    def _purge(self, now: float):
+        # orden de inserción (las terminadas pasan al final): la más antigua va primero
+        while self._entries:
+            key, e = next(iter(self._entries.items()))
+            if e.expires <= now or len(self._entries) > self.max_entries:
+                del self._entries[key]
+            else:
+                break
+
+    def acquire(self, key: Hashable):
+        """Devuelve (entrada, es_dueño)."""
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            e = self._entries.get(key)
+            if e is not None and e.expires > now:
+                self.stats["replayed" if e.done.is_set() else "coalesced"] += 1
+                return e, False
+            e = _Entry()
+            e.expires = now + self.lease
+            self._entries[key] = e
+            self._entries.move_to_end(key)
+            self.stats["owners"] += 1
+            return e, True
+
+    def finish(self, key: Hashable, result):
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                return
+            e.result = result
+            e.expires = time.time() + self.ttl
+            self._entries.move_to_end(key)
+        e.done.set()
+
+    def fail(self, key: Hashable, error: BaseException):
+        with self._lock:
+            e = self._entries.pop(key, None)
+            self.stats["failed"] += 1
+        if e is not None:
+            e.error = error
+            e.done.set()
+
+    def wait(self, entry: _Entry, timeout: float | None = None):
+        if not entry.done.wait(timeout):
+            raise InFlightTimeout()
+        if entry.error is not None:
+            raise entry.error
+        return entry.result
+
+    def run(self, key: Hashable, fn: Callable, timeout: float | None = None):
+        """Ejecuta fn una vez por clave; los duplicados esperan o reciben el resultado guardado."""
+        if not key:
+            return fn()
+        entry, owner = self.acquire(key)
+        if not owner:
+            return self.wait(entry, timeout)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.fail(key, e)
+            raise
+        self.finish(key, result)
+        return result
@@ -0,0 +1,68 @@
+# intents.py — Tabla de intenciones compilada en un solo regex (una pasada por mensaje)
+import re
+from typing import Dict, Iterable, NamedTuple, Tuple
+
+
+class Intent(NamedTuple):
+    name: str
+    patterns: Tuple[str, ...]   # fragmentos regex; se comparan por palabra completa
+    anchored: bool = False      # solo vale al inicio del mensaje ("me llamo ...")
+    payload: bool = False       # el resto del mensaje tras el disparador es el dato
+
+
+class IntentMatch(NamedTuple):
+    name: str
+    payload: str
+    start: int
+
+
+# Orden = prioridad por defecto. Las palabras se comparan completas (\b), así
+# "mal" no salta con "normal" ni "ola" con "cola".
+INTENTS: Tuple[Intent, ...] = (
+    Intent("name",      (r"me llamo",),                         anchored=True, payload=True),
+    Intent("remember",  (r"recuerda que",),                     anchored=True, payload=True),
+    Intent("forget",    (r"olvida",),                           anchored=True, payload=True),
+    Intent("like_list", (r"qu[eé] me gusta",)),
+    Intent("like_add",  (r"me gusta",),                         payload=True),
+    Intent("greet",     (r"hola", r"holi", r"ola", r"buenas", r"hey")),
+    Intent("sad",       (r"triste", r"depre\w*", r"deprimid[oa]s?", r"mal", r"ansios[oa]s?")),
+    Intent("happy",     (r"feliz", r"lo logr[eé]", r"logr[eé]", r"me sali[oó]", r"content[oa]s?")),
+    Intent("bye",       (r"adi[oó]s", r"chao", r"bye", r"nos vemos")),
+)
+
+PAYLOAD_STRIP = " :,.¡!¿?\"'"
+
+
+class IntentMatcher:
+    def __init__(self, intents: Iterable[Intent] = INTENTS):
+        self.intents = {i.name: i for i in intents}
+        alts = [
+            f"(?P<{i.name}>{'|'.join(i.patterns)})" for i in self.intents.values()
+        ]
+        self._re = re.compile(r"\b(?:" + "|".join(alts) + r")\b")
+
+    def scan(self, text: str) -> Dict[str, IntentMatch]:
+        """Todas las intenciones presentes (primera aparición de cada una), en una pasada."""
+        m_text = text.lower().strip()
+        found: Dict[str, IntentMatch] = {}
+        for m in self._re.finditer(m_text):
+            name = m.lastgroup
+            if name in found:
+                continue
+            intent = self.intents[name]
+            if intent.anchored and m.start() != 0:
+                continue
+            payload = m_text[m.end():].strip(PAYLOAD_STRIP) if intent.payload else ""
+            found[name] = IntentMatch(name, payload, m.start())
+        return found
+
+    def match(self, text: str, order: Iterable[str] | None = None) -> IntentMatch | None:
+        """La intención de mayor prioridad (según order, o el orden de la tabla)."""
+        found = self.scan(text)
+        for name in order or self.intents:
+            if name in found:
+                return found[name]
+        return None
+
+
+MATCHER = IntentMatcher()
@@ -0,0 +1,84 @@
+# jobs.py — Cola de trabajos en segundo plano (acotada, con orden por usuario)
+import threading
+import traceback
+from collections import deque
+from typing import Callable, Deque, Dict, Hashable
+
+
+class JobQueue:
+    """
+    Pool de hilos que procesa trabajos fuera del request del webhook.
+    - max_depth: trabajos pendientes máximos (submit devuelve False si está llena)
+    - Los trabajos de una misma clave (p. ej. el número del usuario) se ejecutan
+      en orden y nunca en paralelo; claves distintas sí corren en paralelo.
+    """
+
+    def __init__(self, workers: int = 4, max_depth: int = 100, name: str = "akira-job"):
+        self.workers = max(1, workers)
+        self.max_depth = max(1, max_depth)
+        self._pending: Dict[Hashable, Deque] = {}   # clave -> trabajos en orden
+        self._ready: Deque[Hashable] = deque()      # claves con trabajo y sin worker
+        self._depth = 0
+        self._cv = threading.Condition()
+        self._stopped = False
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"{name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, key: Hashable, fn: Callable, *args, **kwargs) -> bool:
+        with self._cv:
+            if self._stopped or self._depth >= self.max_depth:
+                self.stats["rejected"] += 1
+                return False
+            q = self._pending.get(key)
+            if q is None:
+                # clave nueva: nadie la está procesando → lista para un worker
+                q = self._pending[key] = deque()
+                self._ready.append(key)
+            q.append((fn, args, kwargs))
+            self._depth += 1
+            self.stats["submitted"] += 1
+            self._cv.notify_all()
+            return True
+
+    def depth(self) -> int:
+        with self._cv:
+            return self._depth
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Espera a que la cola se vacíe (útil en pruebas y al apagar)."""
+        with self._cv:
+            return self._cv.wait_for(lambda: self._depth == 0, timeout=timeout)
+
+    def stop(self):
+        with self._cv:
+            self._stopped = True
+            self._cv.notify_all()
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._ready or self._stopped)
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                fn, args, kwargs = self._pending[key].popleft()
+            ok = True
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                ok = False
+                traceback.print_exc()
+            with self._cv:
+                self._depth -= 1
+                self.stats["done" if ok else "failed"] += 1
+                if self._pending[key]:
+                    # sigue habiendo trabajos de este usuario: vuelve a la fila
+                    self._ready.append(key)
+                else:
+                    del self._pending[key]
+                self._cv.notify_all()
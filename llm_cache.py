@@ -0,0 +1,166 @@
+# llm_cache.py — Caché de respuestas del LLM (RAM + disco opcional, LRU + TTL)
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_WS = re.compile(r"\s+")
+
+
+def _norm_text(s: str) -> str:
+    # Preguntas casi iguales (mayúsculas, espacios, tildes compuestas) → misma clave
+    return _WS.sub(" ", unicodedata.normalize("NFC", s)).strip().casefold()
+
+
+def _norm_content(content):
+    if isinstance(content, str):
+        return _norm_text(content)
+    if isinstance(content, list):   # contenido multimodal (texto + image_url)
+        out = []
+        for part in content:
+            if part.get("type") == "text":
+                out.append({"type": "text", "text": _norm_text(part.get("text", ""))})
+            else:
+                out.append(part)
+        return out
+    return content
+
+
+def cache_key(model: str, messages: list, **params) -> str:
+    payload = {
+        "model": model,
+        "params": params,
+        "messages": [{"role": m["role"], "content": _norm_content(m["content"])} for m in messages],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Dos niveles: dict LRU en RAM (max_entries) y, si se da disk_path, SQLite, también LRU
+    con tope de entradas (disk_max_entries) y de bytes de texto (disk_max_bytes).
+    Las entradas caducan a los ttl segundos en ambos niveles; en disco los caducados y lo
+    que sobre se borran cada purge_every escrituras (y con purge_expired()).
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 24 * 3600, disk_path: str | None = None,
+                 disk_max_entries: int = 20000, disk_max_bytes: int = 64 * 1024 * 1024,
+                 purge_every: int = 200):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.purge_every = max(1, purge_every)
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()   # key -> (expira, texto)
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0   # escrituras en disco desde la última purga
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, expires REAL, value TEXT, used REAL)"
+            )
+            cols = {r[1] for r in self._db.execute("PRAGMA table_info(llm_cache)")}
+            if "used" not in cols:   # cachés creadas antes del LRU en disco
+                self._db.execute("ALTER TABLE llm_cache ADD COLUMN used REAL DEFAULT 0")
+        self.stats = {"hits_mem": 0, "hits_disk": 0, "misses": 0, "puts": 0, "evictions": 0, "expired": 0,
+                      "evictions_disk": 0, "expired_disk": 0}
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    self._mem.move_to_end(key)
+                    self.stats["hits_mem"] += 1
+                    return hit[1]
+                del self._mem[key]
+                self.stats["expired"] += 1
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT expires, value FROM llm_cache WHERE key=?", (key,)
+                ).fetchone()
+                if row and row[0] > now:
+                    self._db.execute("UPDATE llm_cache SET used=? WHERE key=?", (now, key))
+                    self._store_mem(key, row[0], row[1])
+                    self.stats["hits_disk"] += 1
+                    return row[1]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        expires = now + self.ttl
+        with self._lock:
+            self._store_mem(key, expires, value)
+            self.stats["puts"] += 1
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)",
+                                 (key, expires, value, now))
+                self._writes += 1
+                if self._writes >= self.purge_every:
+                    self._purge_disk(now)
+
+    def _store_mem(self, key: str, expires: float, value: str):
+        self._mem[key] = (expires, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for k in [k for k, (exp, _) in self._mem.items() if exp <= now]:
+                del self._mem[k]
+                self.stats["expired"] += 1
+            if self._db is not None:
+                self._purge_disk(now)
+
+    def _purge_disk(self, now: float):
+        """Con el lock tomado: borra caducados y, si se pasa de los topes, los menos usados."""
+        self._writes = 0
+        self.stats["expired_disk"] += self._db.execute(
+            "DELETE FROM llm_cache WHERE expires <= ?", (now,)).rowcount
+        n, size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM llm_cache").fetchone()
+        if n <= self.disk_max_entries and size <= self.disk_max_bytes:
+            return
+        victims = []
+        rows = self._db.execute("SELECT key, LENGTH(CAST(value AS BLOB)) FROM llm_cache ORDER BY used")
+        for key, length in rows:
+            if n <= self.disk_max_entries and size <= self.disk_max_bytes:
+                break
+            victims.append((key,))
+            n -= 1
+            size -= length or 0
+        self._db.executemany("DELETE FROM llm_cache WHERE key=?", victims)
+        self.stats["evictions_disk"] += len(victims)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            out = dict(self.stats)
+            out["entries_mem"] = len(self._mem)
+        hits = out["hits_mem"] + out["hits_disk"]
+        total = hits + out["misses"]
+        out["hit_rate"] = hits / total if total else 0.0
+        return out
+
+
+# Caché del proceso. AKIRA_LLM_CACHE=0 la desactiva; AKIRA_LLM_CACHE_DB añade el nivel en disco.
+ENABLED = os.getenv("AKIRA_LLM_CACHE", "1") == "1"
+CACHE = ResponseCache(
+    max_entries=int(os.getenv("AKIRA_LLM_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("AKIRA_LLM_CACHE_TTL", str(24 * 3600))),
+    disk_path=os.getenv("AKIRA_LLM_CACHE_DB") or None,
+    disk_max_entries=int(os.getenv("AKIRA_LLM_CACHE_DISK_SIZE", "20000")),
+    disk_max_bytes=int(os.getenv("AKIRA_LLM_CACHE_DISK_BYTES", str(64 * 1024 * 1024))),
+)
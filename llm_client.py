@@ -0,0 +1,119 @@
+# llm_client.py — Cliente OpenAI compartido con pool de conexiones keep-alive
+import os
+import threading
+import time
+
+# openai/httpx se importan al crear el cliente (primera llamada o pre-warm), no al importar:
+# tardan cientos de ms y /healthz no los necesita.
+
+_lock = threading.Lock()
+_client = None
+_http = None
+_stats = {"clients_created": 0, "requests": 0, "responses": 0, "errors": 0, "total_seconds": 0.0}
+
+
+def _on_request(req):
+    req.extensions["akira_t0"] = time.perf_counter()
+    with _lock:
+        _stats["requests"] += 1
+
+
+def _on_response(resp):
+    t0 = resp.request.extensions.get("akira_t0")
+    with _lock:
+        _stats["responses"] += 1
+        if resp.status_code >= 400:
+            _stats["errors"] += 1
+        if t0 is not None:
+            _stats["total_seconds"] += time.perf_counter() - t0
+
+
+def get_client():
+    """Devuelve el cliente OpenAI del proceso (se crea una sola vez)."""
+    global _client, _http
+    if _client is not None:
+        return _client
+    try:
+        import httpx
+        from openai import OpenAI
+    except Exception:
+        raise RuntimeError("El paquete openai no está disponible en el entorno.")
+    key = os.getenv("OPENAI_API_KEY")
+    if not key:
+        raise RuntimeError("Falta la variable de entorno OPENAI_API_KEY.")
+    with _lock:
+        if _client is None:
+            # Se leen aquí (no al importar) para respetar el .env cargado por la app.
+            # AKIRA_LLM_BASE_URL permite apuntar a un stub local en benchmarks.
+            _stats["pool_max"] = int(os.getenv("AKIRA_LLM_POOL_MAX", "20"))
+            _http = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=_stats["pool_max"],
+                    max_keepalive_connections=int(os.getenv("AKIRA_LLM_POOL_KEEPALIVE", "10")),
+                    keepalive_expiry=float(os.getenv("AKIRA_LLM_KEEPALIVE_EXPIRY", "60")),
+                ),
+                timeout=httpx.Timeout(
+                    float(os.getenv("AKIRA_LLM_READ_TIMEOUT", "60")),
+                    connect=float(os.getenv("AKIRA_LLM_CONNECT_TIMEOUT", "5")),
+                ),
+                event_hooks={"request": [_on_request], "response": [_on_response]},
+            )
+            _client = OpenAI(
+                api_key=key,
+                base_url=os.getenv("AKIRA_LLM_BASE_URL") or None,
+                http_client=_http,
+            )
+            _stats["clients_created"] += 1
+    return _client
+
+
+def client_for(timeout: float | None = None):
+    """
+    Cliente para una llamada con deadline: sin los reintentos del SDK (max_retries=2 por
+    defecto multiplicaría el tiempo) y con timeout = lo que queda. Sin deadline, el compartido.
+    """
+    client = get_client()
+    if timeout is None:
+        return client
+    return client.with_options(max_retries=0, timeout=timeout)   # comparte el pool httpx
+
+
+def pool_stats() -> dict:
+    """Contadores del cliente + conexiones abiertas/ociosas del pool httpx."""
+    with _lock:
+        out = dict(_stats)
+    out["open_connections"] = out["idle_connections"] = 0
+    try:
+        conns = _http._transport._pool.connections  # httpcore.ConnectionPool
+        out["open_connections"] = len(conns)
+        out["idle_connections"] = sum(1 for c in conns if c.is_idle())
+    except Exception:
+        pass
+    return out
+
+
+def reset_client():
+    """Cierra el pool (p. ej. tras un fork o al cambiar la base URL en benchmarks)."""
+    global _client, _http
+    with _lock:
+        if _http is not None:
+            _http.close()
+        _client = _http = None
+
+
+def iter_deltas(stream, on_usage=None, on_finish=None):
+    """
+    Fragmentos de texto de una respuesta chat.completions con stream=True.
+    Con stream_options={"include_usage": True} el último chunk trae usage → on_usage(usage).
+    on_finish(finish_reason) se llama con el motivo de corte ("stop", "length", ...).
+    """
+    for chunk in stream:
+        if on_usage is not None and getattr(chunk, "usage", None):
+            on_usage(chunk.usage)
+        if chunk.choices:
+            choice = chunk.choices[0]
+            if on_finish is not None and getattr(choice, "finish_reason", None):
+                on_finish(choice.finish_reason)
+            delta = choice.delta.content
+            if delta:
+                yield delta
@@ -0,0 +1,147 @@
+# media_fetch.py — Descarga de media de Twilio: sesión con pool, streaming y tope de bytes
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from admission import Overloaded
+
+MIN_TIMEOUT = 0.05   # requests rechaza timeouts de 0
+
+ALLOWED_PREFIXES = ("image/", "text/", "application/pdf",
+                    "application/vnd.openxmlformats-officedocument.wordprocessingml")
+
+
+class MediaRejected(Exception):
+    """La media no se procesa (tipo no soportado o demasiado grande)."""
+
+
+class FetchedMedia(NamedTuple):
+    content_type: str
+    size: int
+    seconds: float
+    data: bytes
+
+
+class MediaFetcher:
+    """
+    - Una requests.Session con pool keep-alive (sin TLS nuevo por descarga)
+    - Rechaza por Content-Type / Content-Length antes de leer el cuerpo
+    - Lee en streaming con tope max_bytes: se corta en cuanto se pasa, sin bajar el resto
+    """
+
+    def __init__(self, auth=None, max_bytes: int = 20 * 1024 * 1024,
+                 pool_size: int = 10, timeout=(5, 30), chunk_size: int = 64 * 1024):
+        self.auth = auth
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.stats = {"downloads": 0, "bytes": 0, "seconds": 0.0, "rejected": 0, "errors": 0}
+
+    def _reject(self, msg: str):
+        with self._lock:
+            self.stats["rejected"] += 1
+        raise MediaRejected(msg)
+
+    def fetch(self, url: str, expected_type: str = "", timeout: float | None = None) -> FetchedMedia:
+        """
+        timeout (opcional): tope total en segundos para esta descarga (p. ej. el deadline).
+        Con el deadline ya vencido lanza Overloaded("deadline") sin hacer el request.
+        """
+        t0 = time.perf_counter()
+        req_timeout = self.timeout
+        if timeout is not None:
+            if timeout <= 0:
+                raise Overloaded("deadline")   # sin tiempo ni para conectar
+            base = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+            req_timeout = tuple(max(MIN_TIMEOUT, min(t, timeout)) for t in base)
+        try:
+            r = self.session.get(url, auth=self.auth, timeout=req_timeout, stream=True)
+        except Exception:
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+        with r:
+            r.raise_for_status()
+            ct = (r.headers.get("Content-Type") or expected_type or "").split(";")[0].strip().lower()
+            if ct and not ct.startswith(ALLOWED_PREFIXES):
+                self._reject(f"Tipo de archivo no soportado: {ct}")
+            length = int(r.headers.get("Content-Length") or 0)
+            if length > self.max_bytes:
+                self._reject(f"Archivo demasiado grande ({length // 1024} KB)")
+
+            # el análisis (visión en base64, páginas del PDF a otros procesos, OCR) necesita
+            # los bytes en memoria: se juntan los trozos una sola vez
+            size, chunks = 0, []
+            for chunk in r.iter_content(self.chunk_size):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    self._reject(f"Archivo demasiado grande (más de {self.max_bytes // 1024} KB)")
+                if timeout is not None and time.perf_counter() - t0 > timeout:
+                    self._reject("La descarga tardó demasiado")
+                chunks.append(chunk)
+            data = b"".join(chunks)
+
+        secs = time.perf_counter() - t0
+        with self._lock:
+            self.stats["downloads"] += 1
+            self.stats["bytes"] += size
+            self.stats["seconds"] += secs
+        return FetchedMedia(ct or expected_type, size, secs, data)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+# ============== Stand-in local (pruebas/benchmarks) ==============
+class LocalMediaServer:
+    """Servidor HTTP local que sirve {ruta: (content_type, bytes)} en 127.0.0.1."""
+
+    def __init__(self, files: dict, port: int = 0):
+        files = dict(files)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                item = files.get(self.path)
+                if item is None:
+                    self.send_error(404)
+                    return
+                ct, body = item
+                self.send_response(200)
+                self.send_header("Content-Type", ct)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def make_fetcher(auth=None) -> MediaFetcher:
+    return MediaFetcher(
+        auth=auth,
+        max_bytes=int(os.getenv("MEDIA_MAX_BYTES", str(20 * 1024 * 1024))),
+        pool_size=int(os.getenv("MEDIA_POOL_SIZE", "10")),
+    )
@@ -1,5 +1,7 @@
 import random
 
+from intents import MATCHER
+
 print("🐾 ¡Hola! Soy Akira, tu compañero leal y asistente personal 💙")
 
 nombre = input("¿Cómo te llamas?: ")
@@ -36,21 +38,23 @@ frases = {
 # Chat principal
 while True:
     mensaje = input(f"{nombre}: ")
+    intent = MATCHER.match(mensaje, order=("like_list", "greet", "like_add", "sad", "bye"))
+    tipo = intent.name if intent else None
 
-    if "hola" in mensaje.lower():
+    if tipo == "greet":
         print("Akira:", random.choice(frases["saludo"]))
-    elif "me gusta" in mensaje.lower():
-        gusto = mensaje.split("me gusta")[-1].strip()
+    elif tipo == "like_add":
+        gusto = intent.payload
         gustos.append(gusto)
         print(f"Akira: ¡Genial! 😄 Me alegra saber que te gusta {gusto}")
-    elif "qué me gusta" in mensaje.lower():
+    elif tipo == "like_list":
         if gustos:
             print(f"Akira: Hasta ahora me dijiste que te gusta: {', '.join(gustos)} 🐾")
         else:
             print("Akira: Aún no me has contado tus gustos 😅")
-    elif "triste" in mensaje.lower():
+    elif tipo == "sad":
         print("Akira:", random.choice(frases["animo_bajo"]))
-    elif "adiós" in mensaje.lower() or "chao" in mensaje.lower():
+    elif tipo == "bye":
         print("Akira:", random.choice(frases["despedida"]))
         break
     else:
@@ -0,0 +1,101 @@
+# outbound.py — Envío de respuestas fuera de banda (Twilio REST o stand-in local)
+import os
+import re
+import threading
+from typing import Callable, List, Tuple
+
+# Mismos límites que analyzer.split_for_whatsapp
+MAX_REPLY_CHARS   = int(os.getenv("MAX_REPLY_CHARS", "1400"))
+STREAM_MIN_CHARS  = int(os.getenv("STREAM_MIN_CHARS", "400"))   # primer envío cuanto antes
+_SENTENCE_END = re.compile(r"(?:[.!?…:]+[\)\]\"'»]*|\n)\s+")
+
+
+class TwilioSender:
+    """Envía mensajes con la API REST de Twilio (Messages)."""
+
+    def __init__(self, account_sid: str | None = None, auth_token: str | None = None,
+                 from_number: str | None = None):
+        from twilio.rest import Client  # perezoso: solo si se usa el modo asíncrono
+        self.client = Client(account_sid or os.getenv("TWILIO_ACCOUNT_SID"),
+                             auth_token or os.getenv("TWILIO_AUTH_TOKEN"))
+        self.from_number = from_number or os.getenv("TWILIO_WHATSAPP_FROM")
+
+    def send(self, to: str, body: str, from_: str | None = None):
+        self.client.messages.create(to=to, from_=from_ or self.from_number, body=body)
+
+
+class LocalSender:
+    """Stand-in para pruebas/desarrollo: guarda los mensajes en memoria y los imprime."""
+
+    def __init__(self, echo: bool = True):
+        self.sent: List[Tuple[str, str]] = []
+        self.echo = echo
+        self._lock = threading.Lock()
+
+    def send(self, to: str, body: str, from_: str | None = None):
+        with self._lock:
+            self.sent.append((to, body))
+        if self.echo:
+            print(">>> OUT", to, "→", body[:80].replace("\n", " "))
+
+
+def make_sender():
+    """AKIRA_OUTBOUND=twilio (por defecto) | local"""
+    kind = os.getenv("AKIRA_OUTBOUND", "twilio").lower()
+    if kind == "local":
+        return LocalSender()
+    return TwilioSender()
+
+
+class SegmentStream:
+    """
+    Convierte un stream de tokens en mensajes de WhatsApp que se envían en cuanto
+    están completos (corte en fin de frase, entre STREAM_MIN_CHARS y MAX_REPLY_CHARS).
+
+    Numeración sin conocer N: los intermedios van como "(1/…)", "(2/…)" y el último
+    como "(N/N)", así el usuario sabe cuándo terminó. Si todo cabe en un mensaje,
+    va sin numerar (igual que split_for_whatsapp).
+    """
+
+    def __init__(self, send: Callable[[str], None], min_chars: int = STREAM_MIN_CHARS,
+                 max_chars: int = MAX_REPLY_CHARS):
+        self.send = send
+        self.min_chars = min_chars
+        self.max_chars = max_chars - 12   # margen para el prefijo "(12/…)\n"
+        self.buf = ""
+        self.sent = 0
+
+    def feed(self, delta: str):
+        self.buf += delta
+        while len(self.buf) > self.min_chars:
+            cut = self._cut()
+            if cut is None:
+                return
+            seg, self.buf = self.buf[:cut].strip(), self.buf[cut:]
+            if seg:
+                self.sent += 1
+                self.send(f"({self.sent}/…)\n{seg}")
+
+    def _cut(self) -> int | None:
+        window = self.buf[: self.max_chars]
+        last = None
+        for m in _SENTENCE_END.finditer(window, self.min_chars):
+            last = m.end()
+        if last is not None and last < len(self.buf):
+            return last
+        if len(self.buf) > self.max_chars:
+            # frase demasiado larga: se corta en el último espacio
+            sp = window.rfind(" ")
+            return sp if sp > 0 else self.max_chars
+        return None
+
+    def close(self):
+        rest = self.buf.strip()
+        self.buf = ""
+        if not self.sent:
+            if rest:
+                self.send(rest)
+            return
+        if rest:
+            self.sent += 1
+            self.send(f"({self.sent}/{self.sent})\n{rest}")
@@ -0,0 +1,133 @@
+# recall.py — Índice invertido BM25 (incremental) sobre los gustos/hechos guardados de un usuario
+import math
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+# Entradas que se inyectan en el prompt por mensaje (las más relevantes)
+RECALL_TOP_K = int(os.getenv("AKIRA_RECALL_TOP_K", "6"))
+
+_WORD = re.compile(r"\w+")
+_STOP = frozenset("""
+a al algo como con de del el ella ellas ellos en era es esa ese eso esta este esto
+fue ha la las le les lo los me mi mis mucho muy no nos o para pero por que se si sin
+sobre su sus te tu tus un una uno unos y ya yo
+""".split())
+
+
+def terms(text: str) -> List[str]:
+    """Minúsculas, sin tildes, sin palabras vacías y con el plural recortado ("gatos" → "gato")."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    out = []
+    for w in _WORD.findall(text):
+        if w in _STOP:
+            continue
+        if len(w) > 4 and w.endswith("es") and w[-3] in "lnrdzjy":
+            w = w[:-2]          # "canciones" → "cancion", "flores" → "flor"
+        elif len(w) > 3 and w.endswith("s"):
+            w = w[:-1]          # "gatos" → "gato"
+        out.append(w)
+    return out
+
+
+class Hit(NamedTuple):
+    text: str
+    kind: str       # like | fact
+    score: float
+
+
+class MemoryIndex:
+    """
+    BM25 sobre entradas cortas. add/remove actualizan solo los postings de sus términos
+    (sin reconstruir); search puntúa solo las entradas que comparten algún término.
+    """
+
+    __slots__ = ("postings", "docs", "by_key", "total_len", "_next")
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, entries: Iterable[Tuple[str, str]] = ()):
+        self.postings: Dict[str, Dict[int, int]] = {}          # término -> {doc: tf}
+        self.docs: Dict[int, Tuple[str, str, int]] = {}       # doc -> (texto, tipo, nº términos)
+        self.by_key: Dict[Tuple[str, str], int] = {}          # (tipo, texto) -> doc
+        self.total_len = 0
+        self._next = 0
+        for kind, text in entries:
+            self.add(text, kind)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, text: str, kind: str = "like") -> bool:
+        if (kind, text) in self.by_key:
+            return False
+        doc, self._next = self._next, self._next + 1
+        ts = terms(text)
+        self.docs[doc] = (text, kind, len(ts))
+        self.by_key[(kind, text)] = doc
+        self.total_len += len(ts)
+        for t in ts:
+            p = self.postings.setdefault(t, {})
+            p[doc] = p.get(doc, 0) + 1
+        return True
+
+    def remove(self, text: str, kind: str = "like") -> bool:
+        doc = self.by_key.pop((kind, text), None)
+        if doc is None:
+            return False
+        _, _, n = self.docs.pop(doc)
+        self.total_len -= n
+        for t in set(terms(text)):
+            p = self.postings.get(t)
+            if p is not None:
+                p.pop(doc, None)
+                if not p:
+                    del self.postings[t]
+        return True
+
+    def search(self, query: str, k: int = RECALL_TOP_K, kinds: Iterable[str] | None = None) -> List[Hit]:
+        """Las k entradas más relevantes para query (solo las que comparten algún término)."""
+        n = len(self.docs)
+        if not n:
+            return []
+        avg = (self.total_len / n) or 1.0
+        kinds = set(kinds) if kinds else None
+        scores: Dict[int, float] = {}
+        for t in set(terms(query)):
+            p = self.postings.get(t)
+            if not p:
+                continue
+            idf = math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for doc, tf in p.items():
+                dl = self.docs[doc][2]
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.K1 + 1) / (
+                    tf + self.K1 * (1 - self.B + self.B * dl / avg))
+        hits = []
+        for doc, sc in sorted(scores.items(), key=lambda kv: (-kv[1], kv[0])):
+            text, kind, _ = self.docs[doc]
+            if kinds is None or kind in kinds:
+                hits.append(Hit(text, kind, sc))
+                if len(hits) >= k:
+                    break
+        return hits
+
+    def matching(self, fragment: str, kinds: Iterable[str] | None = None) -> List[Tuple[str, str]]:
+        """
+        Entradas que contienen todos los términos de fragment (para "olvida ..."): intersección
+        de postings en vez de recorrer las listas. Sin términos útiles, coincidencia literal.
+        """
+        kinds = set(kinds) if kinds else None
+        ts = set(terms(fragment))
+        if ts:
+            lists = sorted((self.postings.get(t, {}) for t in ts), key=len)
+            docs = set(lists[0])
+            for p in lists[1:]:
+                docs &= p.keys()
+        else:
+            frag = fragment.casefold().strip()
+            docs = {d for d, (text, _, _) in self.docs.items() if frag and frag in text.casefold()}
+        out = [(self.docs[d][1], self.docs[d][0]) for d in sorted(docs)]
+        return [(kind, text) for kind, text in out if kinds is None or kind in kinds]
@@ -0,0 +1,422 @@
+# storage.py — Persistencia de memoria (backend enchufable; SQLite WAL con write-behind o compartido)
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# Operaciones (deltas) que se persisten por usuario:
+#   ("turn", uid, role, content, ts)   ("like", uid, thing)   ("unlike", uid, thing)
+#   ("fact", uid, fact)                ("unfact", uid, fact)  ("mood", uid, mood)
+#   ("name", uid, name)                ("summary", uid, texto[, hasta_ts])
+# El resumen acumulado (compaction.py) guarda hasta qué turno (ts) ya está plegado. Los
+# backends compartidos pueden conservar, además de la ventana, hasta keep_unfolded turnos
+# expulsados que aún no entraron en el resumen: así cualquier proceso los pliega una sola vez.
+
+
+def _apply_ops(db: sqlite3.Connection, ops: List[Tuple], max_turns: int, keep_unfolded: int = 0):
+    """Aplica deltas dentro de la transacción abierta en db."""
+    now = time.time()
+    touched = set()
+    for op in ops:
+        kind, uid = op[0], op[1]
+        if uid not in touched:
+            db.execute("INSERT OR IGNORE INTO users (uid, created_at) VALUES (?, ?)", (uid, now))
+            touched.add(uid)
+        if kind == "turn":
+            db.execute("INSERT INTO turns (uid, role, content, ts) VALUES (?, ?, ?, ?)",
+                       (uid, op[2], op[3], op[4]))
+        elif kind == "like":
+            db.execute("INSERT OR IGNORE INTO likes VALUES (?, ?)", (uid, op[2]))
+        elif kind == "unlike":
+            db.execute("DELETE FROM likes WHERE uid=? AND thing=?", (uid, op[2]))
+        elif kind == "fact":
+            db.execute("INSERT OR IGNORE INTO facts VALUES (?, ?)", (uid, op[2]))
+        elif kind == "unfact":
+            db.execute("DELETE FROM facts WHERE uid=? AND fact=?", (uid, op[2]))
+        elif kind == "mood":
+            db.execute("UPDATE users SET mood=? WHERE uid=?", (op[2], uid))
+        elif kind == "name":
+            db.execute("UPDATE users SET name=? WHERE uid=?", (op[2], uid))
+        elif kind == "summary":
+            db.execute("UPDATE users SET summary=?, summary_upto=COALESCE(?, summary_upto) WHERE uid=?",
+                       (op[2], op[3] if len(op) > 3 else None, uid))
+    # recortar historial viejo solo de los usuarios tocados (fuera de la ventana y ya
+    # plegado en el resumen, o más allá de keep_unfolded)
+    for uid in touched:
+        db.execute(
+            "DELETE FROM turns WHERE uid=? AND id NOT IN "
+            "(SELECT id FROM turns WHERE uid=? ORDER BY id DESC LIMIT ?) AND ("
+            "ts <= COALESCE((SELECT summary_upto FROM users WHERE uid=?), 0) OR id NOT IN "
+            "(SELECT id FROM turns WHERE uid=? ORDER BY id DESC LIMIT ?))",
+            (uid, uid, max_turns, uid, uid, max_turns + keep_unfolded),
+        )
+
+
+def _apply_doc(doc: Dict, ops: List[Tuple], max_turns: int, keep_unfolded: int = 0):
+    """Lo mismo que _apply_ops pero sobre el documento JSON de un usuario (RedisBackend)."""
+    for op in ops:
+        kind = op[0]
+        if kind == "turn":
+            doc["turns"].append([op[2], op[3], op[4]])
+        elif kind in ("like", "fact"):
+            bucket = doc["likes" if kind == "like" else "facts"]
+            if op[2] not in bucket:
+                bucket.append(op[2])
+        elif kind in ("unlike", "unfact"):
+            bucket = doc["likes" if kind == "unlike" else "facts"]
+            if op[2] in bucket:
+                bucket.remove(op[2])
+        elif kind in ("mood", "name", "summary"):
+            doc[kind] = op[2]
+            if kind == "summary" and len(op) > 3:
+                doc["summary_upto"] = op[3]
+    turns, upto = doc["turns"], doc.get("summary_upto") or 0.0
+    older = [t for t in turns[:-max_turns] if t[2] > upto][-keep_unfolded:] if keep_unfolded else []
+    doc["turns"] = older + turns[-max_turns:]
+
+
+def _split_turns(turns: List, max_turns: int, upto: float) -> Tuple[List, List]:
+    """(ventana, expulsados sin plegar) a partir de los turnos guardados, del más viejo al más nuevo."""
+    return turns[-max_turns:], [t for t in turns[:-max_turns] if t[2] > upto]
+
+
+def _migrate(db: sqlite3.Connection):
+    """Columnas añadidas después de crear la tabla users (bases de datos antiguas)."""
+    cols = {r[1] for r in db.execute("PRAGMA table_info(users)")}
+    if "summary" not in cols:
+        db.execute("ALTER TABLE users ADD COLUMN summary TEXT")
+    if "version" not in cols:
+        db.execute("ALTER TABLE users ADD COLUMN version INTEGER DEFAULT 0")
+    if "summary_upto" not in cols:
+        db.execute("ALTER TABLE users ADD COLUMN summary_upto REAL DEFAULT 0")
+
+
+class VersionConflict(Exception):
+    """Otro proceso modificó al usuario desde que lo leímos (versión distinta)."""
+
+    def __init__(self, uid: str, version: int):
+        super().__init__(f"{uid}: versión actual {version}")
+        self.uid = uid
+        self.version = version
+
+
+class MemoryBackend:
+    """Interfaz mínima: cargar un usuario y registrar cambios (deltas)."""
+
+    def load(self, uid: str) -> Dict | None:
+        return None
+
+    def record(self, op: str, uid: str, *args):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(MemoryBackend):
+    """
+    SQLite en modo WAL. record() solo encola el delta; un hilo lo escribe en lote
+    cada flush_interval segundos (o al llegar a batch_size), así el request nunca
+    espera al fsync.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        uid TEXT PRIMARY KEY, created_at REAL, mood TEXT DEFAULT 'neutral', name TEXT,
+        summary TEXT, version INTEGER DEFAULT 0, summary_upto REAL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS likes (uid TEXT, thing TEXT, PRIMARY KEY (uid, thing));
+    CREATE TABLE IF NOT EXISTS facts (uid TEXT, fact TEXT, PRIMARY KEY (uid, fact));
+    CREATE TABLE IF NOT EXISTS turns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT, role TEXT, content TEXT, ts REAL
+    );
+    CREATE INDEX IF NOT EXISTS turns_uid ON turns (uid, id);
+    """
+
+    def __init__(self, path: str, max_turns: int = 12, flush_interval: float = 0.5,
+                 batch_size: int = 200):
+        self.path = path
+        self.max_turns = max_turns
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+        _migrate(self._db)
+        self._db_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._ops: List[Tuple] = []
+        self._dirty: set = set()
+        self._cv = threading.Condition()
+        self._closed = False
+        self.stats = {"ops": 0, "flushes": 0, "loads": 0}
+        self._thread = threading.Thread(target=self._loop, name="akira-sqlite", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # -------- lectura (perezosa, por usuario) --------
+    def load(self, uid: str) -> Dict | None:
+        if uid in self._dirty:
+            self.flush()   # que lo pendiente de este usuario sea visible
+        with self._db_lock:
+            self.stats["loads"] += 1
+            row = self._db.execute(
+                "SELECT created_at, mood, name, summary, summary_upto FROM users WHERE uid=?", (uid,)
+            ).fetchone()
+            if row is None:
+                return None
+            likes = [r[0] for r in self._db.execute(
+                "SELECT thing FROM likes WHERE uid=? ORDER BY rowid", (uid,))]
+            facts = [r[0] for r in self._db.execute(
+                "SELECT fact FROM facts WHERE uid=? ORDER BY rowid", (uid,))]
+            turns = self._db.execute(
+                "SELECT role, content, ts FROM turns WHERE uid=? ORDER BY id DESC LIMIT ?",
+                (uid, self.max_turns),
+            ).fetchall()
+        return {
+            "created_at": row[0], "mood": row[1] or "neutral", "name": row[2],
+            "likes": likes, "facts": facts, "turns": turns[::-1], "summary": row[3] or "",
+            "summary_upto": row[4] or 0.0,
+        }
+
+    # -------- escritura diferida --------
+    def record(self, op: str, uid: str, *args):
+        with self._cv:
+            self._ops.append((op, uid) + args)
+            self._dirty.add(uid)
+            self.stats["ops"] += 1
+            if len(self._ops) >= self.batch_size:
+                self._cv.notify()
+
+    def flush(self):
+        with self._flush_lock:   # un solo flush a la vez: conserva el orden de los deltas
+            with self._cv:
+                ops, self._ops = self._ops, []
+            if ops:
+                self._write(ops)
+            with self._cv:
+                self._dirty = {op[1] for op in self._ops}
+
+    def _write(self, ops: List[Tuple]):
+        with self._db_lock:
+            db = self._db
+            db.execute("BEGIN")
+            try:
+                _apply_ops(db, ops, self.max_turns)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            self.stats["flushes"] += 1
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                self._cv.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception as e:
+                print(">>> ERROR guardando memoria:", repr(e))
+            if closed:
+                return
+
+    def close(self):
+        with self._cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._cv.notify()
+        self._thread.join(timeout=5)
+        with self._db_lock:
+            self._db.close()
+
+
+# ------------------------------------------------------------------
+# Backends compartidos entre procesos/instancias (varios workers de gunicorn)
+# ------------------------------------------------------------------
+# Con shared = True, Memory escribe de forma síncrona con apply(uid, ops, versión esperada)
+# (compare-and-swap por usuario) y revalida su copia local con version(uid).
+
+class SharedSQLiteBackend(MemoryBackend):
+    """
+    Un fichero SQLite (WAL) compartido por todos los procesos de la máquina.
+    Cada escritura es una transacción BEGIN IMMEDIATE que comprueba y sube la versión
+    del usuario; sin hilo de write-behind para que los demás procesos la vean al instante.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, max_turns: int = 12, busy_timeout: float = 5.0,
+                 keep_unfolded: int = 0):
+        self.path = path
+        self.max_turns = max_turns
+        self.keep_unfolded = keep_unfolded
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()   # una conexión por hilo
+        db = self._conn()
+        db.executescript(SQLiteBackend.SCHEMA)
+        _migrate(db)
+        self.stats = {"applies": 0, "conflicts": 0, "loads": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def version(self, uid: str) -> int:
+        row = self._conn().execute("SELECT version FROM users WHERE uid=?", (uid,)).fetchone()
+        return (row[0] or 0) if row else 0
+
+    def load(self, uid: str) -> Dict | None:
+        db = self._conn()
+        self.stats["loads"] += 1
+        db.execute("BEGIN")   # lectura consistente (snapshot WAL)
+        try:
+            row = db.execute(
+                "SELECT created_at, mood, name, version, summary, summary_upto FROM users WHERE uid=?",
+                (uid,)
+            ).fetchone()
+            if row is None:
+                return None
+            likes = [r[0] for r in db.execute(
+                "SELECT thing FROM likes WHERE uid=? ORDER BY rowid", (uid,))]
+            facts = [r[0] for r in db.execute(
+                "SELECT fact FROM facts WHERE uid=? ORDER BY rowid", (uid,))]
+            turns = db.execute(
+                "SELECT role, content, ts FROM turns WHERE uid=? ORDER BY id DESC LIMIT ?",
+                (uid, self.max_turns + self.keep_unfolded),
+            ).fetchall()
+        finally:
+            db.execute("COMMIT")
+        window, unfolded = _split_turns(turns[::-1], self.max_turns, row[5] or 0.0)
+        return {
+            "created_at": row[0], "mood": row[1] or "neutral", "name": row[2],
+            "likes": likes, "facts": facts, "turns": window, "version": row[3] or 0,
+            "summary": row[4] or "", "summary_upto": row[5] or 0.0, "unfolded": unfolded,
+        }
+
+    def apply(self, uid: str, ops: List[Tuple], expected: int | None) -> int:
+        """Aplica ops si la versión sigue siendo expected (None = sin condición); devuelve la nueva."""
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")   # toma el lock de escritura antes de leer la versión
+        try:
+            row = db.execute("SELECT version FROM users WHERE uid=?", (uid,)).fetchone()
+            current = (row[0] or 0) if row else 0
+            if expected is not None and current != expected:
+                raise VersionConflict(uid, current)
+            _apply_ops(db, ops, self.max_turns, self.keep_unfolded)
+            db.execute("UPDATE users SET version=? WHERE uid=?", (current + 1, uid))
+            db.execute("COMMIT")
+        except BaseException as e:
+            db.execute("ROLLBACK")
+            if isinstance(e, VersionConflict):
+                self.stats["conflicts"] += 1
+            raise
+        self.stats["applies"] += 1
+        return current + 1
+
+    def record(self, op: str, uid: str, *args):
+        self.apply(uid, [(op, uid) + args], None)
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class RedisBackend(MemoryBackend):
+    """
+    Estado compartido entre máquinas en un servidor con protocolo Redis. Cada usuario es
+    un hash {v: versión, doc: JSON}; apply() usa WATCH/MULTI como compare-and-swap.
+    Para pruebas vale cualquier cliente compatible (p. ej. fakeredis.FakeRedis()).
+    """
+
+    shared = True
+
+    def __init__(self, url: str | None = None, max_turns: int = 12, client=None,
+                 prefix: str = "akira:u:", keep_unfolded: int = 0):
+        try:
+            import redis  # perezoso y opcional: solo si se usa este backend
+            from redis.exceptions import WatchError
+        except ImportError as e:
+            raise RuntimeError("AKIRA_MEM_SHARED=redis://... necesita el paquete redis "
+                               "(pip install redis)") from e
+        if client is None:
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self._WatchError = WatchError
+        self.r = client
+        self.max_turns = max_turns
+        self.keep_unfolded = keep_unfolded
+        self.prefix = prefix
+        self.stats = {"applies": 0, "conflicts": 0, "loads": 0}
+
+    def version(self, uid: str) -> int:
+        v = self.r.hget(self.prefix + uid, "v")
+        return int(v) if v else 0
+
+    def load(self, uid: str) -> Dict | None:
+        self.stats["loads"] += 1
+        v, doc = self.r.hmget(self.prefix + uid, "v", "doc")
+        if not doc:
+            return None
+        doc = json.loads(doc)
+        doc["version"] = int(v or 0)
+        doc.setdefault("summary", "")
+        doc.setdefault("summary_upto", 0.0)
+        doc["turns"], doc["unfolded"] = _split_turns(
+            [tuple(t) for t in doc["turns"]], self.max_turns, doc["summary_upto"])
+        return doc
+
+    def apply(self, uid: str, ops: List[Tuple], expected: int | None) -> int:
+        key = self.prefix + uid
+        with self.r.pipeline() as p:
+            while True:
+                try:
+                    p.watch(key)
+                    v, raw = p.hmget(key, "v", "doc")
+                    current = int(v or 0)
+                    if expected is not None and current != expected:
+                        raise VersionConflict(uid, current)
+                    doc = json.loads(raw) if raw else {
+                        "created_at": time.time(), "mood": "neutral", "name": None,
+                        "likes": [], "facts": [], "turns": [], "summary": "", "summary_upto": 0.0,
+                    }
+                    _apply_doc(doc, ops, self.max_turns, self.keep_unfolded)
+                    p.multi()
+                    p.hset(key, mapping={"v": current + 1, "doc": json.dumps(doc, ensure_ascii=False)})
+                    p.execute()
+                    break
+                except self._WatchError:
+                    if expected is not None:   # alguien escribió entre WATCH y EXEC
+                        self.stats["conflicts"] += 1
+                        raise VersionConflict(uid, self.version(uid))
+                except VersionConflict:
+                    self.stats["conflicts"] += 1
+                    raise
+        self.stats["applies"] += 1
+        return current + 1
+
+    def record(self, op: str, uid: str, *args):
+        self.apply(uid, [(op, uid) + args], None)
+
+
+def open_shared(url: str, max_turns: int = 12, keep_unfolded: int = 0) -> MemoryBackend:
+    """AKIRA_MEM_SHARED: sqlite:///ruta.db (misma máquina) | redis://host:6379/0"""
+    if url.startswith("sqlite:///"):
+        return SharedSQLiteBackend(url[len("sqlite:///"):], max_turns=max_turns,
+                                   keep_unfolded=keep_unfolded)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url, max_turns=max_turns, keep_unfolded=keep_unfolded)
+    raise ValueError(f"AKIRA_MEM_SHARED no soportado: {url}")
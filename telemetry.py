@@ -0,0 +1,236 @@
+# telemetry.py — Tiempos por etapa, contadores y traza por request (texto Prometheus en /metrics)
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Tuple
+
+# Cubetas de latencia en segundos (de TwiML a un PDF largo)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+TRACE_LOG = os.getenv("AKIRA_TRACE_LOG", "1") == "1"   # una línea JSON por request
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_esc(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                out.append(f"{self.name}{_labels(self.labels, key)} {v:g}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, tuple(buckets)
+        self._series: Dict[Tuple, list] = {}   # clave -> [conteos por cubeta..., suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+                    break
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for key, s in sorted(self._series.items()):
+                acc = 0
+                for b, n in zip(self.buckets, s):
+                    acc += n
+                    out.append(f"{self.name}_bucket{_labels(names, key + (f'{b:g}',))} {acc}")
+                out.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {s[-1]}")
+                out.append(f"{self.name}_sum{_labels(self.labels, key)} {s[-2]:.6f}")
+                out.append(f"{self.name}_count{_labels(self.labels, key)} {s[-1]}")
+        return out
+
+
+class Registry:
+    """Métricas propias + colectores (funciones que devuelven un dict de números → gauges)."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors: Dict[str, Callable[[], dict]] = {}
+
+    def counter(self, name, help, labels=()) -> Counter:
+        m = Counter(name, help, labels)
+        self.metrics.append(m)
+        return m
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS) -> Histogram:
+        m = Histogram(name, help, labels, buckets)
+        self.metrics.append(m)
+        return m
+
+    def collect(self, prefix: str, fn: Callable[[], dict]):
+        self.collectors[prefix] = fn
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        for prefix, fn in self.collectors.items():
+            try:
+                values = _flatten(fn())
+            except Exception as e:
+                print(">>> ERROR en métricas", prefix, repr(e))
+                continue
+            for k, v in values.items():
+                name = f"akira_{prefix}_{k}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {v:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        k = f"{prefix}{k}".replace("-", "_").replace(".", "_")
+        if isinstance(v, dict):
+            out.update(_flatten(v, k + "_"))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[k] = v
+    return out
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "akira_request_seconds", "Duración total por request/trabajo", ("kind", "outcome"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "akira_stage_seconds", "Duración por etapa (descarga, extracción, OCR, LLM, TwiML...)", ("stage",))
+EVENTS = REGISTRY.counter(
+    "akira_events_total", "Eventos: heurística que evita el LLM, aciertos de caché, descartes...", ("event",))
+LLM_TOKENS = REGISTRY.counter(
+    "akira_llm_tokens_total", "Tokens informados por la API en cada llamada", ("stage", "type"))
+
+
+# ------------------------------ Traza por request ------------------------------
+class Trace:
+    __slots__ = ("kind", "fields", "stages", "events", "tokens", "t0")
+
+    def __init__(self, kind: str, fields: dict):
+        self.kind = kind
+        self.fields = fields
+        self.stages = []   # [(etapa, segundos)]
+        self.events = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.t0 = time.perf_counter()
+
+    def set(self, **fields):
+        self.kind = fields.pop("kind", self.kind)
+        self.fields.update(fields)
+
+
+_TRACE: contextvars.ContextVar = contextvars.ContextVar("akira_trace", default=None)
+_STAGE: contextvars.ContextVar = contextvars.ContextVar("akira_stage", default="")
+
+
+def current() -> Trace | None:
+    return _TRACE.get()
+
+
+def current_stage() -> str:
+    return _STAGE.get()
+
+
+@contextmanager
+def trace(kind: str, **fields):
+    """Abre la traza del request; al salir registra la duración y escribe una línea JSON."""
+    t = Trace(kind, fields)
+    token = _TRACE.set(t)
+    outcome = "ok"
+    try:
+        yield t
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        _TRACE.reset(token)
+        total = time.perf_counter() - t.t0
+        REQUEST_SECONDS.observe(total, kind=t.kind, outcome=outcome)
+        if TRACE_LOG:
+            print(">>> TRACE " + json.dumps({
+                "kind": t.kind, "outcome": outcome, "ms": round(total * 1000, 1),
+                **t.fields,
+                "stages": [[name, round(s * 1000, 1)] for name, s in t.stages],
+                "events": t.events, "tokens": t.tokens,
+            }, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def stage(name: str):
+    """Cronometra una etapa (histograma + traza actual). Las etapas pueden anidarse."""
+    token = _STAGE.set(name)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        _STAGE.reset(token)
+        STAGE_SECONDS.observe(dt, stage=name)
+        t = _TRACE.get()
+        if t is not None:
+            t.stages.append((name, dt))
+
+
+def observe(name: str, seconds: float):
+    """Duración de una etapa medida fuera de stage() (p. ej. en otro proceso): solo histograma."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+
+
+def count(event: str, n: int = 1):
+    EVENTS.inc(n, event=event)
+    t = _TRACE.get()
+    if t is not None:
+        t.events[event] = t.events.get(event, 0) + n
+
+
+def record_usage(usage):
+    """Acumula usage (prompt/completion tokens) de una respuesta de chat.completions."""
+    if usage is None:
+        return
+    where = _STAGE.get() or "llm"
+    t = _TRACE.get()
+    for kind in ("prompt", "completion"):
+        n = getattr(usage, f"{kind}_tokens", None) or 0
+        if n:
+            LLM_TOKENS.inc(n, stage=where, type=kind)
+            if t is not None:
+                t.tokens[kind] += n
+
+
+def propagate(fn: Callable) -> Callable:
+    """Envuelve fn para que corra en otro hilo (pool) dentro de la traza/etapa actual."""
+    ctx = contextvars.copy_context()
+    return lambda *a, **kw: ctx.run(fn, *a, **kw)
@@ -0,0 +1,32 @@
+# Regresión: una entrada en vuelo que nunca termina no debe frenar la purga
+import time
+
+from idempotency import Idempotency
+
+
+def test_stuck_owner_does_not_block_purge():
+    idem = Idempotency(ttl=0.01, max_entries=3, lease=60)
+    idem.acquire("colgado")             # dueño que nunca llama a finish/fail
+    for i in range(50):
+        idem.acquire(f"sid{i}")
+        idem.finish(f"sid{i}", ["ok"])
+    time.sleep(0.02)
+    idem.acquire("ultimo")
+    assert len(idem._entries) <= 3
+
+
+def test_stuck_owner_lease_expires():
+    idem = Idempotency(ttl=600, lease=0.01)
+    _, owner = idem.acquire("sid")
+    assert owner
+    assert not idem.acquire("sid")[1]   # en vuelo: el reintento no es dueño
+    time.sleep(0.02)
+    assert idem.acquire("sid")[1]       # lease vencido: el reintento vuelve a procesar
+
+
+def test_finished_result_is_replayed():
+    idem = Idempotency(ttl=600, max_entries=3)
+    idem.acquire("sid")
+    idem.finish("sid", ["hola"])
+    entry, owner = idem.acquire("sid")
+    assert not owner and idem.wait(entry, 0) == ["hola"]
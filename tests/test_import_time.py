@@ -0,0 +1,23 @@
+# Arranque: bench/check_import_time.py como prueba (import de app_twilio rápido y sin deps pesadas)
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("twilio")
+
+_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     "bench", "check_import_time.py")
+_spec = importlib.util.spec_from_file_location("check_import_time", _PATH)
+check_import_time = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(check_import_time)
+
+BUDGET = float(os.getenv("IMPORT_BUDGET", "1.0"))
+
+
+def test_app_import_is_lazy_and_fast():
+    runs = [check_import_time.measure() for _ in range(3)]
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    assert not loaded, f"dependencias pesadas importadas al arrancar: {loaded}"
+    assert min(r["seconds"] for r in runs) <= BUDGET
@@ -0,0 +1,43 @@
+# Tabla de intenciones: palabras completas, prioridad y payload
+import pytest
+
+from intents import MATCHER
+
+
+@pytest.mark.parametrize("text, name", [
+    ("hola akira", "greet"),
+    ("Buenas!", "greet"),
+    ("hoy estoy triste", "sad"),
+    ("me siento mal", "sad"),
+    ("¡lo logré!", "happy"),
+    ("adiós", "bye"),
+    ("¿qué me gusta?", "like_list"),
+])
+def test_positive(text, name):
+    assert MATCHER.match(text).name == name
+
+
+@pytest.mark.parametrize("text", [
+    "todo normal",        # "mal" dentro de "normal"
+    "quiero una cola",    # "ola" dentro de "cola"
+    "me encanta la playa",
+    "la ecuación de segundo grado",
+])
+def test_negative(text):
+    assert MATCHER.match(text) is None
+
+
+def test_payload():
+    assert MATCHER.match("me gusta el fútbol.") == ("like_add", "el fútbol", 0)
+    assert MATCHER.match("Me llamo Sofi").payload == "sofi"
+
+
+def test_anchored_only_at_start():
+    assert MATCHER.match("me llamo Ana").name == "name"
+    assert "name" not in MATCHER.scan("mi prima dice: me llamo Ana")
+
+
+def test_table_order_is_priority():
+    # saludo y tristeza en el mismo mensaje: manda el orden de la tabla, o el que se pida
+    assert MATCHER.match("hola, estoy triste").name == "greet"
+    assert MATCHER.match("hola, estoy triste", order=("sad", "greet")).name == "sad"
@@ -0,0 +1,54 @@
+# JobQueue: orden y exclusión por clave, paralelismo entre claves, cola acotada
+import threading
+import time
+
+from jobs import JobQueue
+
+
+def test_same_key_runs_in_order_and_never_in_parallel():
+    q = JobQueue(workers=4)
+    done, running, overlaps = [], set(), []
+    lock = threading.Lock()
+
+    def job(key, i):
+        with lock:
+            if key in running:
+                overlaps.append((key, i))
+            running.add(key)
+        time.sleep(0.001)
+        with lock:
+            running.discard(key)
+            done.append((key, i))
+
+    for i in range(30):
+        for key in ("ana", "beto", "caro"):
+            assert q.submit(key, job, key, i)
+    assert q.join(timeout=10)
+    assert not overlaps
+    for key in ("ana", "beto", "caro"):
+        assert [i for k, i in done if k == key] == list(range(30))
+
+
+def test_other_keys_are_not_blocked():
+    q = JobQueue(workers=2)
+    release = threading.Event()
+    q.submit("lento", release.wait, 5)
+    q.submit("lento", lambda: None)            # detrás del lento, en su misma fila
+    ran = threading.Event()
+    q.submit("rapido", ran.set)
+    assert ran.wait(2)                          # otra clave corre aunque "lento" siga ocupado
+    release.set()
+    assert q.join(timeout=5)
+
+
+def test_full_queue_rejects_and_failures_do_not_stop_workers():
+    q = JobQueue(workers=1, max_depth=2)
+    release = threading.Event()
+    assert q.submit("u", release.wait, 5)
+    assert q.submit("u", lambda: 1 / 0)         # falla, pero el worker sigue
+    assert not q.submit("u", lambda: None)     # llena
+    release.set()
+    assert q.join(timeout=5)
+    ok = threading.Event()
+    assert q.submit("u", ok.set) and ok.wait(2)
+    assert q.stats["rejected"] == 1 and q.stats["failed"] == 1
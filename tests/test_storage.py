@@ -0,0 +1,31 @@
+# Backend compartido: compare-and-swap por versión y reintento de Memory ante conflicto
+import pytest
+
+from akira_brain import Memory
+from storage import SharedSQLiteBackend, VersionConflict
+
+
+def test_apply_rejects_stale_version(tmp_path):
+    db = SharedSQLiteBackend(str(tmp_path / "mem.db"))
+    v1 = db.apply("u", [("mood", "u", "feliz")], 0)
+    with pytest.raises(VersionConflict):
+        db.apply("u", [("mood", "u", "triste")], 0)     # otro proceso ya escribió la v1
+    assert db.apply("u", [("mood", "u", "triste")], v1) == v1 + 1
+    assert db.load("u")["mood"] == "triste"
+
+
+def test_memory_retries_on_conflict(tmp_path):
+    path = str(tmp_path / "mem.db")
+    # dos "procesos"; a confía en su copia local todo el test (no revalida antes de escribir)
+    a = Memory(backend=SharedSQLiteBackend(path), read_ttl=3600)
+    b = Memory(backend=SharedSQLiteBackend(path), read_ttl=3600)
+    a.add_turn("u", "user", "hola desde a")
+    b.add_turn("u", "user", "hola desde b")           # b cargó tras la escritura de a
+    a.add_like("u", "gatos")                           # versión vieja → conflicto → recarga y reintenta
+    assert a.stats()["shared"]["conflicts"] == 1
+
+    fresh = Memory(backend=SharedSQLiteBackend(path))
+    assert fresh.get_likes("u") == ["gatos"]
+    assert [t.content for t in fresh.by_user["u"].turns] == ["hola desde a", "hola desde b"]
+    # a quedó con el estado fusionado, no con su copia vieja
+    assert [t.content for t in a.by_user["u"].turns] == ["hola desde a", "hola desde b"]
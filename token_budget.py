@@ -0,0 +1,146 @@
+# token_budget.py — Estimación de tokens y recorte de prompts/salidas por presupuesto
+import os
+import re
+import threading
+from typing import Callable, List, Sequence
+
+_ENC = None          # tokenizer de gpt-4o / gpt-4o-mini (o200k_base), si tiktoken está instalado
+_ENC_LOADED = False
+_ENC_LOCK = threading.Lock()
+
+# Presupuesto por llamada (prompt + respuesta) y topes de la respuesta
+CALL_TOKEN_BUDGET = int(os.getenv("CALL_TOKEN_BUDGET", "4000"))
+REPLY_TOKENS_MAX  = int(os.getenv("REPLY_TOKENS_MAX", "600"))
+REPLY_TOKENS_MIN  = int(os.getenv("REPLY_TOKENS_MIN", "150"))
+
+# Tokenizer real solo para textos cortos; en textos largos basta la heurística (y es O(1))
+_EXACT_MAX_CHARS = 2000
+
+_SENTENCE_END = re.compile(r"[.!?…]+[\)\]\"'»]*\s+|\n\s*\n")
+
+
+def _encoder():
+    """Carga tiktoken y su tabla al primer uso (tarda; no debe pagarlo el arranque)."""
+    global _ENC, _ENC_LOADED
+    if not _ENC_LOADED:
+        with _ENC_LOCK:
+            if not _ENC_LOADED:
+                try:
+                    import tiktoken
+                    _ENC = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    _ENC = None
+                _ENC_LOADED = True
+    return _ENC
+
+
+def count_tokens(text: str) -> int:
+    """Tokens aproximados: tiktoken si está instalado; si no, ~4 bytes UTF-8 por token."""
+    if not text:
+        return 0
+    if len(text) <= _EXACT_MAX_CHARS and _encoder() is not None:
+        return len(_ENC.encode(text, disallowed_special=()))
+    # los emojis y tildes ocupan más bytes y también más tokens
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def count_messages(messages: Sequence[dict]) -> int:
+    total = 0
+    for m in messages:
+        c = m.get("content")
+        if isinstance(c, str):
+            total += count_tokens(c)
+        elif isinstance(c, list):
+            total += sum(count_tokens(p.get("text", "")) for p in c if p.get("type") == "text")
+        total += 4   # rol + separadores
+    return total
+
+
+def _safe_cut(s: str, i: int) -> int:
+    """Retrocede i para no partir un emoji/secuencia ZWJ, modificador o tilde combinada."""
+    while 0 < i < len(s) and (
+        s[i] in "\u200d\ufe0f" or "\u0300" <= s[i] <= "\u036f"
+        or "\U0001f3fb" <= s[i] <= "\U0001f3ff" or s[i - 1] == "\u200d"
+    ):
+        i -= 1
+    return i
+
+
+def _boundary(s: str, start: int, end: int) -> int:
+    """Mejor corte en (start, end]: fin de frase, si no espacio, si no carácter seguro."""
+    window = s[start:end]
+    last = None
+    for m in _SENTENCE_END.finditer(window):
+        last = m.end()
+    if last is not None and last > len(window) // 3:
+        return start + last
+    sp = max(window.rfind(" "), window.rfind("\n"))
+    if sp > len(window) // 3:
+        return start + sp + 1
+    return _safe_cut(s, end) or end
+
+
+def split_text(s: str, max_len: int) -> List[str]:
+    """
+    Parte s en trozos de hasta max_len caracteres cortando en fin de frase o palabra.
+    Cada carácter se mira a lo sumo dos veces: tiempo lineal.
+    """
+    s = s.strip()
+    if len(s) <= max_len:
+        return [s]
+    parts, i = [], 0
+    while i < len(s):
+        if len(s) - i <= max_len:
+            parts.append(s[i:].strip())
+            break
+        cut = _boundary(s, i, i + max_len)
+        if cut <= i:
+            cut = i + max_len
+        piece = s[i:cut].strip()
+        if piece:
+            parts.append(piece)
+        i = cut
+    return [p for p in parts if p]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta text a ~max_tokens, en el último fin de frase/palabra que quepa."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    approx_chars = max(1, max_tokens * 4)
+    while approx_chars > 1 and count_tokens(text[:approx_chars]) > max_tokens:
+        approx_chars = int(approx_chars * 0.9)
+    return text[:_boundary(text, 0, approx_chars)].rstrip()
+
+
+def fit_recent(items: Sequence, budget: int, measure: Callable = None) -> list:
+    """Los elementos más recientes (del final) que caben en budget tokens, en su orden."""
+    measure = measure or count_tokens
+    out, used = [], 0
+    for it in reversed(items):
+        t = measure(it)
+        if used + t > budget:
+            break
+        out.append(it)
+        used += t
+    out.reverse()
+    return out
+
+
+def fit_items(items: Sequence[str], budget: int) -> List[str]:
+    """Los primeros elementos (p. ej. hechos/gustos) que caben en budget tokens."""
+    out, used = [], 0
+    for it in items:
+        t = count_tokens(it) + 1
+        if used + t > budget:
+            break
+        out.append(it)
+        used += t
+    return out
+
+
+def reply_budget(prompt_tokens: int, call_budget: int = CALL_TOKEN_BUDGET,
+                 ceiling: int = REPLY_TOKENS_MAX, floor: int = REPLY_TOKENS_MIN) -> int:
+    """max_tokens para la respuesta: lo que sobra del presupuesto, entre floor y ceiling."""
+    return max(floor, min(ceiling, call_budget - prompt_tokens))
+